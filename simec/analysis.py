@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Voltammogram features.
+Peak currents and potentials, peak separation, half-wave potential and the
+reverse to forward peak current ratio, computed at once for batches of
+simulated or experimental cyclic voltammograms.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import numpy as np
+
+
+def capacitive_baseline(potential, current, window=10):
+    # charging current estimated from the first window points of each curve,
+    # where only the double layer charges, with the sign of the sweep
+    # direction: +ic on the forward and -ic on the reverse scan; the
+    # direction at each point is the one of the step that follows it, as
+    # in the capacitive current of Simulation
+    direction = np.sign(np.diff(potential, axis=-1))
+    direction = np.concatenate([direction, direction[..., -1:]], axis=-1)
+    start = current[..., 1:window + 1].mean(axis=-1, keepdims=True)
+    return start * direction * direction[..., :1]
+
+
+def refine_peak(potential, current, k, valid):
+    # peak potential and current from the parabola through the points
+    # k - 1, k, k + 1 of each curve (where valid)
+    take = lambda y, i: np.take_along_axis(y, i[..., None], axis=-1)[..., 0]
+    k0 = np.clip(k, 1, current.shape[-1] - 2)
+    ym, y0, yp = take(current, k0 - 1), take(current, k0), take(current, k0 + 1)
+    curvature = ym - 2 * y0 + yp
+    safe = valid & (k == k0) & (curvature != 0)
+    delta = np.where(safe, 0.5 * (ym - yp) / np.where(curvature != 0, curvature, 1), 0.0)
+    delta = np.clip(delta, -0.5, 0.5)
+    peak = take(current, k) - 0.25 * (ym - yp) * np.where(safe, delta, 0.0)
+    Em, E0, Ep = take(potential, k0 - 1), take(potential, k), take(potential, k0 + 1)
+    return E0 + np.where(safe, delta * (Ep - Em) / 2, 0.0), peak
+
+
+def cv_features(potential, current, baseline=None, window=10):
+    """Features of one sweep out and back, for arrays shaped (..., points).
+
+    baseline is subtracted from the current first: an array that
+    broadcasts to it (e.g. the capcurrent of a Simulation or
+    BatchSimulation), "capacitive" to estimate it with capacitive_baseline,
+    or None. The forward peak is searched on the scan up to the switching
+    potential, in the direction of the scan, and the reverse peak on the
+    way back; peaks are refined with a parabola through three points.
+    Returns a dict of arrays (one value per curve): Epc, ipc, Epa, ipa,
+    dEp = Epa - Epc, E12 = (Epa + Epc) / 2, ratio (reverse to forward peak
+    current, with Nicholson's correction for the decaying forward current,
+    irev/ifwd + 0.485 isp/ifwd + 0.086) and switch (index of the switching
+    potential).
+    """
+    potential = np.asarray(potential, dtype=float)
+    current = np.asarray(current, dtype=float)
+    potential, current = np.broadcast_arrays(potential, current)
+    if isinstance(baseline, str):
+        baseline = capacitive_baseline(potential, current, window)
+    if baseline is not None:
+        current = current - baseline
+
+    # direction: -1 when the scan starts towards negative potentials
+    start = potential[..., :1]
+    switch = np.abs(potential - start).argmax(axis=-1)
+    index = np.arange(potential.shape[-1])
+    Eswitch = np.take_along_axis(potential, switch[..., None], axis=-1)[..., 0]
+    direction = np.sign(Eswitch - start[..., 0])
+    forward = index <= switch[..., None]
+    reverse = index >= switch[..., None]
+
+    signed = direction[..., None] * current
+    kfwd = np.where(forward, signed, -np.inf).argmax(axis=-1)
+    krev = np.where(reverse, -signed, -np.inf).argmax(axis=-1)
+    Efwd, ifwd = refine_peak(potential, current, kfwd, kfwd != switch)
+    Erev, irev = refine_peak(potential, current, krev, krev != switch)
+    isp = np.take_along_axis(current, switch[..., None], axis=-1)[..., 0]
+
+    cathodic_first = direction < 0
+    features = {"Epc": np.where(cathodic_first, Efwd, Erev), "ipc": np.where(cathodic_first, ifwd, irev),
+                "Epa": np.where(cathodic_first, Erev, Efwd), "ipa": np.where(cathodic_first, irev, ifwd)}
+    features["dEp"] = features["Epa"] - features["Epc"]
+    features["E12"] = (features["Epa"] + features["Epc"]) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        features["ratio"] = -irev / ifwd + 0.485 * isp / ifwd + 0.086
+    features["switch"] = switch
+    return features
+
+
+def batch_features(results, baselines=None, window=10):
+    # cv_features of several results (SimulationResult or simdata lists)
+    # with the same number of points; baselines is one per result (arrays
+    # or scalars), or as in cv_features
+    potential = np.array([result[0] for result in results])
+    current = np.array([result[1] for result in results])
+    if baselines is not None and not isinstance(baselines, str):
+        baselines = np.array([np.broadcast_to(b, current.shape[-1:]) for b in baselines])
+    return cv_features(potential, current, baselines, window)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Benchmarks of the simulations.
+Times a run and its peak memory for each mechanism, technique and grid size,
+and checks the accuracy of the results against analytical solutions, so
+changes in speed, memory or accuracy can be measured and compared between
+versions: python benchmark.py --save before.json, then after a change
+python benchmark.py --compare before.json. With --startup, the time for the
+main window to appear is measured too, and checked against STARTUP_TARGET;
+python benchmark.py --startup-only runs only that check, and exits with 1
+when it fails. Without PyQt5, the check still makes sure the main window
+does not import the deferred modules, against a stub Qt.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import tempfile
+import subprocess
+import numpy as np
+import math as mt
+from simulation import F, R
+from convolution import simulate
+from config import SimConfig, TECHNIQUES
+from analysis import cv_features
+
+# mechanisms, and (tunits, xunits) grid sizes; the sizes keep the explicit
+# solver stable (alambda about 0.3) for the default configs
+BENCH_MECHANISMS = ("E", "EC", "ECat", "CE")
+SIZES = {"quick": ((1000, 100),),
+         "default": ((1000, 100), (4000, 200)),
+         "full": ((1000, 100), (4000, 200), (16000, 400))}
+
+# STARTUP_TARGET: seconds for the main window to appear, from a fresh
+# interpreter; DEFERRED_MODULES: modules that must not be imported until a
+# simulation is run or plotted
+STARTUP_TARGET = 1.0
+DEFERRED_MODULES = ("numpy", "matplotlib", "scipy", "pics_rc", "simwindow", "simulation")
+STARTUP_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+import simec
+simec.app = app
+window = simec.MainWindow()
+window.show()
+app.processEvents()
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "imported": [m for m in %r if m in sys.modules]}))
+"""
+# STUB_QT: stand-in for the PyQt5 modules used by the main window, where
+# every name and attribute is an object that accepts any call, so the
+# imports can be checked without PyQt5
+STUB_QT = """
+class Stub(type):
+    def __getattr__(cls, name):
+        return Any()
+
+
+class Any(metaclass=Stub):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Any()
+
+    def __call__(self, *args, **kwargs):
+        return Any()
+
+    def __getitem__(self, key):
+        return Any()
+
+    def __or__(self, other):
+        return Any()
+
+
+def __getattr__(name):
+    return Any
+"""
+
+
+def bench_config(technique, mechanism):
+    # default config, with the homogeneous reactions switched on
+    config = SimConfig(technique=technique, mechanism=mechanism)
+    if mechanism != "E":
+        config = config.replace(kcf=1.0, kcr=0.1)
+    return config
+
+
+def measure(run, repeat=3):
+    # best wall time of repeat calls of run, and the peak memory (bytes)
+    # allocated during one more call, traced apart so tracing does not slow
+    # the timed calls
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(seconds), peak, result
+
+
+def timing(sizes, repeat=3, engine="grid", solver="explicit"):
+    # one row per mechanism, technique and grid size
+    rows = []
+    for technique in TECHNIQUES:
+        for mechanism in BENCH_MECHANISMS:
+            config = bench_config(technique, mechanism)
+            for tunits, xunits in sizes:
+                seconds, peak, _ = measure(lambda: simulate(config, engine, solver=solver, tunits=tunits,
+                                                            xunits=xunits), repeat)
+                rows.append({"name": "%s %s %dx%d" % (technique, mechanism, tunits, xunits), "seconds": seconds,
+                             "peak_bytes": peak})
+    return rows
+
+
+def randles_sevcik(config, reversible=True):
+    # peak current (A) of a sweep for a reversible or a fully irreversible
+    # electron transfer, with semi-infinite planar diffusion
+    f = config.n * F / (R * config.temp)
+    if reversible:
+        return 0.4463 * config.n * F * config.area * config.conc_bulk * mt.sqrt(f * config.scanrate * config.D)
+    return 0.4958 * config.n * F * config.area * config.conc_bulk * \
+        mt.sqrt(config.alpha * f * config.scanrate * config.D)
+
+
+def cottrell(config, t):
+    # diffusion-limited current (A) at time t after a potential step
+    return config.n * F * config.area * config.conc_bulk * np.sqrt(config.D / (mt.pi * t))
+
+
+def accuracy(tunits=4000, xunits=200, engine="grid", solver="explicit"):
+    # simulated against analytical values for the E mechanism; error is
+    # relative, except for potentials (absolute, in V)
+    rows = []
+
+    def row(name, simulated, expected, relative=True):
+        error = abs(simulated - expected) / abs(expected) if relative else abs(simulated - expected)
+        rows.append({"name": name, "simulated": float(simulated), "expected": float(expected), "error": float(error)})
+
+    options = {"solver": solver, "tunits": tunits, "xunits": xunits}
+    for name, ko, reversible in (("reversible", 10.0, True), ("irreversible", 1e-5, False)):
+        config = SimConfig(ko=ko)
+        result = simulate(config, engine, **options).get_data()
+        features = cv_features(result.potential, result.current)
+        row("Voltammetry E %s ipc" % name, -features["ipc"], randles_sevcik(config, reversible))
+        if reversible:
+            row("Voltammetry E reversible E12", features["E12"], config.Eform, relative=False)
+
+    # past the first tenth of the pulse, where the few steps after the jump
+    # are not resolved
+    config = SimConfig(technique="Chronoamperometry", ko=10.0)
+    result = simulate(config, engine, **options).get_data()
+    t = result.time - config.t1
+    window = t > 0.1 * (config.tend - config.t1)
+    errors = np.abs(-result.current[window] - cottrell(config, t[window])) / cottrell(config, t[window])
+    worst = errors.argmax()
+    row("Chronoamperometry E Cottrell", -result.current[window][worst], cottrell(config, t[window][worst]))
+    return rows
+
+
+def startup(repeat=3, stub=None):
+    # best time for the main window to appear, each time in a new
+    # interpreter (offscreen unless a display is set), and the deferred
+    # modules that were imported anyway; None without PyQt5. stub: a
+    # directory with a stub PyQt5 to import instead
+    environment = dict(os.environ)
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if stub is not None:
+        environment["PYTHONPATH"] = os.pathsep.join(filter(None, [stub, environment.get("PYTHONPATH")]))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT % (DEFERRED_MODULES,)], cwd=directory,
+                                 env=environment, capture_output=True, text=True)
+        if process.returncode != 0:
+            if "No module named 'PyQt5'" in process.stderr:
+                return None
+            raise RuntimeError(process.stderr)
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda run: run["seconds"])
+    return {"name": "GUI startup", "seconds": best["seconds"], "peak_bytes": 0, "imported": best["imported"]}
+
+
+def startup_check(repeat=3):
+    # the startup row (None without PyQt5) and whether the check passed:
+    # the main window appears within STARTUP_TARGET without importing the
+    # DEFERRED_MODULES; without PyQt5 only the imports are checked, with
+    # STUB_QT in place of PyQt5
+    launch = startup(repeat)
+    if launch is not None:
+        print("GUI startup: %.3f s (target %.1f s)" % (launch["seconds"], STARTUP_TARGET))
+        imported = launch["imported"]
+    else:
+        with tempfile.TemporaryDirectory() as stub:
+            os.mkdir(os.path.join(stub, "PyQt5"))
+            for name in ("__init__", "QtCore", "QtGui", "QtWidgets"):
+                with open(os.path.join(stub, "PyQt5", name + ".py"), "w") as f:
+                    f.write(STUB_QT if name != "__init__" else "")
+            imported = startup(1, stub)["imported"]
+        print("GUI startup: PyQt5 is not available, imports checked with a stub Qt")
+    if imported:
+        print("Imported at startup, but should be deferred: %s" % ", ".join(imported))
+    passed = not imported and (launch is None or launch["seconds"] <= STARTUP_TARGET)
+    return launch, passed
+
+
+def compare(rows, previous, threshold=0.2):
+    # rows that got slower, took more memory or lost accuracy by more than
+    # threshold (relative) against the previous rows of the same name
+    previous = {row["name"]: row for row in previous}
+    regressions = []
+    for row in rows:
+        old = previous.get(row["name"])
+        if old is None:
+            continue
+        for field in ("seconds", "peak_bytes", "error"):
+            if field in row and field in old and row[field] > old[field] * (1 + threshold) + 1e-12:
+                regressions.append("%s: %s %.4g -> %.4g" % (row["name"], field, old[field], row[field]))
+    return regressions
+
+
+def report(timings, accuracies):
+    lines = ["%-40s %12s %12s" % ("case", "seconds", "peak MiB")]
+    lines += ["%-40s %12.4f %12.2f" % (r["name"], r["seconds"], r["peak_bytes"] / 2 ** 20) for r in timings]
+    lines += ["", "%-40s %12s %12s %10s" % ("accuracy", "simulated", "expected", "error")]
+    lines += ["%-40s %12.4g %12.4g %10.2e" % (r["name"], r["simulated"], r["expected"], r["error"])
+              for r in accuracies]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark simEC simulations")
+    parser.add_argument("--sizes", choices=sorted(SIZES), default="default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engine", choices=("grid", "convolution", "auto"), default="grid")
+    parser.add_argument("--solver", default="explicit")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of earlier results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--startup", action="store_true", help="also time the start of the interface")
+    parser.add_argument("--startup-only", action="store_true", help="only check the start of the interface")
+    args = parser.parse_args(argv)
+
+    if args.startup_only:
+        launch, passed = startup_check(args.repeat)
+        return 0 if passed else 1
+
+    timings = timing(SIZES[args.sizes], args.repeat, args.engine, args.solver)
+    accuracies = accuracy(engine=args.engine, solver=args.solver)
+    print(report(timings, accuracies))
+
+    failed = False
+    if args.startup:
+        print()
+        launch, passed = startup_check(args.repeat)
+        if launch is not None:
+            timings.append(launch)
+        failed = not passed
+
+    results = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+               "timing": timings, "accuracy": accuracies}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(timings + accuracies, previous["timing"] + previous["accuracy"], args.threshold)
+        print("\n".join(["", "Regressions:"] + regressions) if regressions else "\nNo regressions")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
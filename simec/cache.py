@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Result cache for simulations.
+Results are stored under a hash of the simconfig, the engine, its version
+and the grid settings, in a memory LRU tier and an optional on-disk tier of
+compressed arrays.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import os
+import json
+import inspect
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from simulation import Simulation
+from convolution import ConvolutionSimulation, convolution_applies, simulate
+from result import SimulationResult
+
+# CACHE_VERSION: bump when results of the same inputs change, so old entries
+# are no longer found
+CACHE_VERSION = 3
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "simEC")
+ENGINES = {"grid": Simulation, "convolution": ConvolutionSimulation}
+# UNKEYED_OPTIONS: keyword arguments that do not change the results
+UNKEYED_OPTIONS = ("profile", "progress")
+
+
+def canonical(value):
+    # JSON-friendly form of value where equal inputs give equal output:
+    # numbers as floats, sequences as lists, objects (mechanisms, waveforms)
+    # as their class name and attributes
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return canonical(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in value.items()}
+    if hasattr(value, "__iter__"):
+        # sequence-like objects such as config.SimConfig hash as lists
+        return [canonical(item) for item in value]
+    return {"class": type(value).__name__, "attributes": canonical(vars(value))}
+
+
+def config_key(simconfig, engine="auto", **simkwargs):
+    # hash of everything that decides a result; keyword arguments the engine
+    # does not take are left out and the ones not given take their defaults
+    if engine == "auto":
+        engine = "convolution" if convolution_applies(simconfig, simkwargs) else "grid"
+    parameters = inspect.signature(ENGINES[engine]).parameters
+    options = {name: p.default for name, p in parameters.items() if p.default is not inspect.Parameter.empty}
+    options.update((name, value) for name, value in simkwargs.items() if name in parameters)
+    for name in UNKEYED_OPTIONS:
+        options.pop(name, None)
+    description = {"simconfig": simconfig, "engine": engine, "options": options,
+                   "version": [__version__, CACHE_VERSION]}
+    text = json.dumps(canonical(description), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class SimulationCache():
+    """Two-tier cache of SimulationResults (as returned by get_data).
+
+    The memory tier keeps the most recently used results up to memory_bytes;
+    if directory is given, results are also written there as compressed
+    .npz files, and the least recently used files are deleted once they add
+    up to more than disk_bytes. Cached arrays are read-only.
+    """
+
+    def __init__(self, directory=None, memory_bytes=256 * 2**20, disk_bytes=2**30):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        # cached result for key, or None
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.directory and os.path.exists(self.path(key)):
+            with np.load(self.path(key)) as stored:
+                result = SimulationResult.from_arrays(dict(stored))
+            os.utime(self.path(key))
+            self.disk_hits += 1
+            self.remember(key, result)
+            return result
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        self.remember(key, result)
+        if self.directory:
+            temp = self.path(key) + ".tmp"
+            with open(temp, "wb") as f:
+                np.savez_compressed(f, **result.arrays())
+            os.replace(temp, self.path(key))
+            self.evict_disk()
+        return result
+
+    def remember(self, key, result):
+        # add to the memory tier, dropping the least recently used results
+        for array in result.arrays().values():
+            array.flags.writeable = False
+        if key in self.memory:
+            self.memory_used -= self.memory.pop(key).nbytes
+        self.memory[key] = result
+        self.memory_used += result.nbytes
+        while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+            oldkey, old = self.memory.popitem(last=False)
+            self.memory_used -= old.nbytes
+
+    def evict_disk(self):
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".npz")]
+        files = sorted((os.stat(f).st_mtime, os.stat(f).st_size, f) for f in files)
+        used = sum(size for mtime, size, f in files)
+        for mtime, size, f in files[:-1]:
+            if used <= self.disk_bytes:
+                break
+            os.remove(f)
+            used -= size
+
+    def run(self, simconfig, engine="auto", **simkwargs):
+        # result for simconfig, simulated only if it is not cached
+        key = config_key(simconfig, engine, **simkwargs)
+        result = self.get(key)
+        if result is None:
+            result = self.put(key, simulate(simconfig, engine, **simkwargs).get_data())
+        return result
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory), "memory_bytes": self.memory_used}
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Command line batch runner.
+Runs the simulations of job files without the graphical interface, on a
+pool of worker processes, and writes the results to one .npz archive:
+python cli.py jobs.json -o results.npz --workers 8
+
+A job file (JSON, or TOML with Python 3.11+) holds a list of jobs, or a
+table with "options" for all the jobs and a "jobs" list. Each job has a
+"config" (SimConfig fields by name; the others keep their defaults, or the
+23 positional simconfig entries), optionally a "name" and "options"
+(keyword arguments of Simulation, plus "engine"), and optionally a sweep:
+"grid" (every combination of the listed values) or "list" (values taken
+together) of simconfig fields, e.g.
+{"name": "rates", "config": {"mechanism": "EC"}, "grid": {"kcf": [0.1, 1, 10]}}
+
+PyQt5, matplotlib and scipy are never imported, except matplotlib when a
+plot is asked for with --plot.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from simulation import SIMCONFIG_FIELDS
+from config import SimConfig
+from convolution import simulate, convolution_applies
+from cache import SimulationCache, CACHE_DIRECTORY
+from sweep import parameter_grid, parameter_list, run_sweep
+
+# CHECKED_OPTIONS: job options that SimConfig.problems takes into account
+CHECKED_OPTIONS = ("solver", "tunits", "xunits", "grid", "gamma", "cycles")
+
+
+def read_jobs(path):
+    # (options, jobs) of a JSON or TOML job file
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as f:
+            content = tomllib.load(f)
+    else:
+        with open(path) as f:
+            content = json.load(f)
+    if isinstance(content, list):
+        return {}, content
+    return content.get("options", {}), content.get("jobs", [])
+
+
+def job_config(config):
+    # SimConfig from the fields of a job (by name) or the positional list
+    if isinstance(config, dict):
+        unknown = set(config) - set(SIMCONFIG_FIELDS)
+        if unknown:
+            raise ValueError("Unknown simconfig fields: %s" % ", ".join(sorted(unknown)))
+        return SimConfig(**config)
+    return SimConfig.from_list(config)
+
+
+def expand_jobs(options, jobs):
+    # one (name, params, simconfig, simkwargs) case per simulation
+    cases = []
+    for number, job in enumerate(jobs):
+        name = job.get("name", "job%d" % number)
+        simkwargs = dict(options, **job.get("options", {}))
+        base = job_config(job.get("config", {}))
+        if "grid" in job and "list" in job:
+            raise ValueError("Job %s has both a grid and a list sweep" % name)
+        if "grid" in job:
+            expanded = parameter_grid(base, **job["grid"])
+        elif "list" in job:
+            expanded = parameter_list(base, **job["list"])
+        else:
+            expanded = [({}, base)]
+        cases += [(name, params, simconfig, simkwargs) for params, simconfig in expanded]
+    return cases
+
+
+def case_problems(simconfig, simkwargs):
+    # SimConfig.problems for the options of a case; E cases that simulate
+    # sends to the convolution engine have no stability limit, and are
+    # checked as for an implicit solver (storage as in run_cases)
+    options = {name: value for name, value in simkwargs.items() if name in CHECKED_OPTIONS}
+    engine = simkwargs.get("engine", "auto")
+    if engine == "convolution" or engine == "auto" and \
+            convolution_applies(simconfig, dict({"storage": "rolling"}, **simkwargs)):
+        options["solver"] = "implicit"
+    return simconfig.problems(**options)
+
+
+def run_cases(cases, workers=1, cache=None):
+    # (index, simdata) of every case as they finish; cases sharing the same
+    # options are run together, in the pool of run_sweep unless workers = 1
+    groups = {}
+    for index, (name, params, simconfig, simkwargs) in enumerate(cases):
+        groups.setdefault(json.dumps(simkwargs, sort_keys=True), []).append(index)
+    for key, indices in groups.items():
+        simkwargs = dict(json.loads(key))
+        simkwargs.setdefault("storage", "rolling")
+        if workers == 1:
+            for index in indices:
+                simconfig = cases[index][2]
+                if cache is not None:
+                    yield index, cache.run(simconfig, **simkwargs)
+                else:
+                    yield index, simulate(simconfig, **simkwargs).get_data()
+            continue
+        # the case index takes the place of the params of run_sweep
+        sweep = [(index, cases[index][2]) for index in indices]
+        for position, index, simdata in run_sweep(sweep, workers, cache=cache, **simkwargs):
+            yield index, simdata
+
+
+def save_results(path, cases, results, dtype=np.float64, compress=False):
+    # one archive: the arrays of case i under "i/<name>" (see
+    # SimulationResult.arrays) and a JSON description of every case under
+    # "cases"
+    arrays = {}
+    description = []
+    for index, (name, params, simconfig, simkwargs) in enumerate(cases):
+        for field, array in results[index].astype(dtype).arrays().items():
+            arrays["%d/%s" % (index, field)] = array
+        description.append({"name": name, "params": params, "config": simconfig.to_dict(), "options": simkwargs,
+                            "key": simconfig.key()})
+    arrays["cases"] = np.array(json.dumps(description))
+    (np.savez_compressed if compress else np.savez)(path, **arrays)
+
+
+def load_results(path):
+    # (description, SimulationResult) of every case saved by save_results
+    from result import SimulationResult
+    with np.load(path) as stored:
+        description = json.loads(str(stored["cases"]))
+        results = []
+        for index in range(len(description)):
+            prefix = "%d/" % index
+            arrays = {name[len(prefix):]: stored[name] for name in stored.files if name.startswith(prefix)}
+            results.append(SimulationResult.from_arrays(arrays))
+    return list(zip(description, results))
+
+
+def plot_results(path, cases, results):
+    # current against potential (or time, for chronoamperometry) of every
+    # case, to an image file
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(8, 6))
+    axes = figure.add_subplot(111)
+    for index, (name, params, simconfig, simkwargs) in enumerate(cases):
+        x = results[index].time if simconfig.technique == "Chronoamperometry" else results[index].potential
+        label = name + "".join(" %s=%g" % item for item in params.items())
+        axes.plot(x, results[index].current, label=label)
+    axes.set_xlabel("Time (s)" if all(c[2].technique == "Chronoamperometry" for c in cases) else "Potential (V)")
+    axes.set_ylabel("Current (A)")
+    if len(cases) <= 12:
+        axes.legend(fontsize="small")
+    figure.savefig(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run simEC simulations from job files, without the interface")
+    parser.add_argument("jobs", nargs="+", help="JSON or TOML job files")
+    parser.add_argument("-o", "--output", default="results.npz", help="results archive (.npz)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--dtype", choices=("float64", "float32"), default="float64")
+    parser.add_argument("--compress", action="store_true", help="compress the archive")
+    parser.add_argument("--cache", nargs="?", const=CACHE_DIRECTORY, help="cache results in this directory")
+    parser.add_argument("--plot", help="also plot the results to this image file (needs matplotlib)")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    cases = []
+    for path in args.jobs:
+        try:
+            cases += expand_jobs(*read_jobs(path))
+        except (OSError, ValueError, TypeError) as error:
+            print("%s: %s" % (path, error), file=sys.stderr)
+            return 2
+    # every config is checked before any simulation starts
+    problems = ["%s%s: %s" % (name, " %s" % params if params else "", problem)
+                for name, params, simconfig, simkwargs in cases
+                for problem in case_problems(simconfig, simkwargs)]
+    if problems:
+        print("\n".join(problems), file=sys.stderr)
+        return 2
+
+    cache = SimulationCache(args.cache) if args.cache else None
+    results = [None] * len(cases)
+    start = time.perf_counter()
+    for done, (index, simdata) in enumerate(run_cases(cases, max(1, args.workers), cache), 1):
+        results[index] = simdata
+        if not args.quiet:
+            print("%d/%d %s %s %.1fs" % (done, len(cases), cases[index][0], cases[index][1] or "",
+                                         time.perf_counter() - start), file=sys.stderr)
+
+    save_results(args.output, cases, results, np.dtype(args.dtype), args.compress)
+    if args.plot:
+        plot_results(args.plot, cases, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
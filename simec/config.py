@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Typed simulation configuration.
+SimConfig holds the 23 simconfig entries as named, typed fields with units
+and validation; it still iterates and indexes like the positional list, so
+every function that takes a simconfig list takes a SimConfig too.
+SimConfigBatch is the struct-of-arrays form of many configs.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import json
+import hashlib
+import dataclasses
+import numpy as np
+from simulation import SIMCONFIG_FIELDS, SOLVERS, spatial_grid, grid_units, default_waveform
+from mechanisms import MECHANISMS, Mechanism
+from cache import canonical
+
+TECHNIQUES = ("Voltammetry", "Chronoamperometry")
+
+
+def quantity(default, units):
+    return dataclasses.field(default=default, metadata={"units": units})
+
+
+@dataclasses.dataclass(frozen=True)
+class SimConfig():
+    """One simulation; the defaults are the ones of the main window."""
+
+    technique: str = "Voltammetry"
+    mechanism: object = "E"
+    Estart: float = quantity(0.5, "V")
+    Eswitch: float = quantity(-0.7, "V")
+    scanrate: float = quantity(0.1, "V/s")
+    Eform: float = quantity(0.0, "V")
+    n: float = quantity(1.0, "")
+    ko: float = quantity(0.01, "cm/s")
+    alpha: float = quantity(0.5, "")
+    D: float = quantity(1e-6, "cm2/s")
+    D2: float = quantity(1e-6, "cm2/s")
+    area: float = quantity(0.1, "cm2")
+    temp: float = quantity(298.0, "K")
+    conc_bulk: float = quantity(5e-8, "mol/cm3")
+    kcf: float = quantity(0.0, "1/s")
+    kcr: float = quantity(0.0, "1/s")
+    EstartAmp: float = quantity(0.8, "V")
+    t1: float = quantity(3.0, "s")
+    Epulse: float = quantity(-0.5, "V")
+    tend: float = quantity(30.0, "s")
+    Cdl: float = quantity(0.0, "uF/cm2")
+    shift: float = quantity(0.0, "uA")
+    ru: float = quantity(0.0, "ohm")
+
+    @classmethod
+    def from_list(cls, simconfig):
+        # SimConfig from the positional simconfig list
+        if len(simconfig) != len(SIMCONFIG_FIELDS):
+            raise ValueError("A simconfig has %d entries, not %d" % (len(SIMCONFIG_FIELDS), len(simconfig)))
+        return cls(*simconfig)
+
+    @staticmethod
+    def units(name):
+        return {f.name: f.metadata.get("units", "") for f in dataclasses.fields(SimConfig)}[name]
+
+    def __iter__(self):
+        return (getattr(self, name) for name in SIMCONFIG_FIELDS)
+
+    def __len__(self):
+        return len(SIMCONFIG_FIELDS)
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def to_list(self):
+        return list(self)
+
+    def to_dict(self):
+        return dict(zip(SIMCONFIG_FIELDS, self))
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+    def key(self):
+        # hash that is the same in every process and session
+        return hashlib.sha256(json.dumps(canonical(self.to_list())).encode()).hexdigest()
+
+    def problems(self, solver="explicit", tunits=1000, xunits=100, grid="uniform", gamma=1.1, cycles=1,
+                 waveform=None):
+        # list of the reasons this config can not run as asked with these
+        # Simulation options
+        problems = []
+        if self.technique not in TECHNIQUES:
+            problems.append("Unknown technique: %s" % self.technique)
+        if not isinstance(self.mechanism, Mechanism) and self.mechanism not in MECHANISMS:
+            problems.append("Unknown mechanism: %s" % self.mechanism)
+        if solver not in SOLVERS:
+            problems.append("Unknown solver: %s" % solver)
+        for name in ("scanrate", "n", "D", "D2", "area", "temp"):
+            if not getattr(self, name) > 0:
+                problems.append("%s must be positive" % name)
+        for name in ("ko", "conc_bulk", "kcf", "kcr", "Cdl", "ru"):
+            if getattr(self, name) < 0:
+                problems.append("%s can not be negative" % name)
+        if not 0 < self.alpha < 1:
+            problems.append("alpha must be between 0 and 1")
+        if self.technique == "Voltammetry" and self.Estart == self.Eswitch:
+            problems.append("Estart and Eswitch must differ")
+        if self.technique == "Chronoamperometry" and not 0 <= self.t1 < self.tend:
+            problems.append("t1 must be between 0 and tend")
+        if problems:
+            return problems
+
+        # alambda: D deltat / deltax**2 at the electrode, which the explicit
+        # solver needs at or below 0.5
+        if solver == "explicit":
+            ttot = (waveform or default_waveform(self, cycles)).duration
+            D = max(self.D, self.D2)
+            distance = spatial_grid(6 * np.sqrt(D * ttot), grid_units(xunits, cycles, grid, gamma), grid, gamma)
+            alambda = D * ttot / (tunits * cycles) / (distance[1] - distance[0]) ** 2
+            if alambda > 0.5:
+                problems.append("Unstable explicit solver: alambda = %.3g > 0.5; use more time units, fewer "
+                                "distance units or an implicit solver" % alambda)
+        return problems
+
+    def validate(self, **options):
+        # raise ValueError listing every problem; options as in problems()
+        problems = self.problems(**options)
+        if problems:
+            raise ValueError("; ".join(problems))
+        return self
+
+
+class SimConfigBatch():
+    """Struct-of-arrays form of several SimConfigs.
+
+    technique and mechanism are shared by all the configs; every numeric
+    field is an array with one entry per config, e.g. batch.ko.
+    """
+
+    def __init__(self, configs):
+        configs = [c if isinstance(c, SimConfig) else SimConfig.from_list(c) for c in configs]
+        if not configs:
+            raise ValueError("A batch needs at least one config")
+        for name in ("technique", "mechanism"):
+            if len(set(getattr(c, name) for c in configs)) > 1:
+                raise ValueError("All the configs of a batch must share the %s" % name)
+        self.technique = configs[0].technique
+        self.mechanism = configs[0].mechanism
+        for name in SIMCONFIG_FIELDS[2:]:
+            setattr(self, name, np.array([getattr(c, name) for c in configs], dtype=float))
+
+    @classmethod
+    def from_base(cls, base, **values):
+        # batch of base with the named fields taking the given values, e.g.
+        # SimConfigBatch.from_base(SimConfig(), ko=[0.01, 0.1, 1])
+        length = len(next(iter(values.values())))
+        return cls([base.replace(**{name: v[i] for name, v in values.items()}) for i in range(length)])
+
+    def __len__(self):
+        return len(self.Estart)
+
+    def __getitem__(self, index):
+        return SimConfig(self.technique, self.mechanism,
+                         *(float(getattr(self, name)[index]) for name in SIMCONFIG_FIELDS[2:]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def problems(self, **options):
+        # problems of every config of the batch, prefixed with its index;
+        # options as in SimConfig.problems
+        return ["config %d: %s" % (i, problem) for i, config in enumerate(self)
+                for problem in config.problems(**options)]
+
+    def validate(self, **options):
+        # raise ValueError listing every problem of every config
+        problems = self.problems(**options)
+        if problems:
+            raise ValueError("; ".join(problems))
+        return self
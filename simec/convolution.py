@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Convolution engine for the E mechanism.
+For a single electron transfer at a planar electrode with semi-infinite
+diffusion, the surface concentrations follow from the semi-integral of the
+flux, so the current is found without a spatial grid.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import numpy as np
+import math as mt
+from simulation import Simulation, SimulationSetup, SIMCONFIG_FIELDS, F
+from result import SimulationResult
+
+# options that need the concentration grid (or profile its phases), and
+# keyword arguments of Simulation that the convolution engine takes too
+GRID_OPTIONS = ("snapshot_every", "snapshot_times", "adaptive", "profile")
+SHARED_OPTIONS = ("tunits", "waveform", "cycles", "progress")
+
+
+def fft_convolve(a, b, size):
+    # first size terms of the linear convolution of a and b
+    nfft = 1 << (len(a) + len(b) - 2).bit_length()
+    return np.fft.irfft(np.fft.rfft(a, nfft) * np.fft.rfft(b, nfft), nfft)[:size]
+
+
+class ConvolutionSimulation():
+    """E mechanism current from the semi-integral of the surface flux.
+
+    With J the rate of reduction (mol cm-2 s-1) and I its semi-integral,
+    I(t) = int_0^t J(u) / sqrt(pi (t - u)) du, the surface concentrations
+    are cox = cox* - I / sqrt(Dox) and cred = cred* + I / sqrt(Dred), and J
+    is given by Butler-Volmer kinetics at those concentrations. J is taken
+    constant over each time step, so I(tn) = sum_j J_j w_(n-j), and every
+    step is one linear equation in J_n once the history sum is known. The
+    history sums are added block by block with FFT convolutions (divide and
+    conquer over the time steps), O(N log^2 N) in the number of steps.
+    The results have the layout of Simulation, with the concentrations at
+    the electrode surface (distance = 0) only. progress is called as in
+    Simulation, after every block of steps.
+    """
+
+    BLOCK = 64
+
+    def __init__(self, simconfig, tunits=1000, waveform=None, cycles=1, progress=None):
+        setup = SimulationSetup(simconfig, tunits, 2, waveform=waveform, cycles=cycles)
+        tunits = setup.tunits
+        mech = setup.mech
+        ox, red = mech.oxidised[0], mech.reduced[0]
+        self.time = setup.time
+        self.potential = setup.potential
+        self.capcurrent = setup.capcurrent
+        self.distance = np.zeros(1)
+        self.species = mech.species
+
+        # w: semi-integration weights for a flux constant over each step
+        # J: reduction rate at each time; history: semi-integral of J from
+        # the steps already solved
+        steps = np.arange(tunits + 1)
+        w = 2 * mt.sqrt(setup.deltat / mt.pi) * (np.sqrt(steps + 1) - np.sqrt(steps))
+        self.w = w
+        self.J = np.zeros(tunits + 1)
+        self.history = np.zeros(tunits + 1)
+        self.kf = setup.kf[:, 0]
+        self.kb = setup.kb[:, 0]
+        self.bulk = mech.bulk[[ox, red]]
+        self.sqrtD = np.sqrt(mech.D[[ox, red]])
+        self.progress = progress
+        self.solve(1, tunits + 1)
+
+        semi = self.history + w[0] * self.J
+        self.csurface = self.bulk + np.array([-1, 1]) * semi[:, None] / self.sqrtD
+        self.csurface[0] = self.bulk
+        self.cox = self.csurface[:, :1]
+        self.cred = self.csurface[:, 1:]
+        self.cchem = None
+
+        self.current_total = np.zeros(tunits + 1)
+        self.current_total[1:] = -F * setup.area * mech.n[0] * self.J[1:] + self.capcurrent[1:]
+        self.current_total = self.current_total + 1e-6*setup.shift
+
+        # Calculate iR drop and correct potentials
+        irdrop = setup.ru * self.current_total
+        self.potential = self.potential + irdrop
+
+        if setup.technique == "Chronoamperometry":
+            # drop the t = 0 point, as Simulation does
+            self.potential = self.potential[1:]
+            self.current_total = self.current_total[1:]
+            self.time = self.time[1:]
+            self.csurface = self.csurface[1:]
+            self.cox = self.cox[1:]
+            self.cred = self.cred[1:]
+
+    def solve(self, lo, hi):
+        # solve J[lo:hi], with the history of the steps before lo already
+        # added; the first half is solved, its history added to the second
+        # half with one convolution, then the second half is solved
+        J, w, history = self.J, self.w, self.history
+        if hi - lo <= self.BLOCK:
+            cox, cred = self.bulk
+            sqrtDox, sqrtDred = self.sqrtD
+            for n in range(lo, hi):
+                h = history[n] + J[lo:n] @ w[n - lo:0:-1]
+                kf, kb = self.kf[n], self.kb[n]
+                J[n] = (kf * (cox - h / sqrtDox) - kb * (cred + h / sqrtDred)) / \
+                    (1 + w[0] * (kf / sqrtDox + kb / sqrtDred))
+                history[n] = h
+            if self.progress is not None:
+                self.progress(hi - 1, len(J) - 1)
+            return
+        mid = (lo + hi) // 2
+        self.solve(lo, mid)
+        history[mid:hi] += fft_convolve(J[lo:mid], w[:hi - lo], hi - lo)[mid - lo:]
+        self.solve(mid, hi)
+
+    def get_data(self, dtype=np.float64):
+        # same layout as Simulation.get_data
+        return SimulationResult(self.time, self.potential, self.current_total, self.distance,
+                                self.csurface[:, :, None], ("ox", "red"), self.time, dtype)
+
+
+def convolution_applies(simconfig, simkwargs):
+    # the convolution engine covers the E mechanism when neither the
+    # concentration profiles, adaptive time steps nor the coupled iR drop
+    # are asked for
+    mechanism = dict(zip(SIMCONFIG_FIELDS, simconfig))["mechanism"]
+    if mechanism != "E":
+        return False
+    if simkwargs.get("storage") == "full" or any(simkwargs.get(option) for option in GRID_OPTIONS) or \
+            simkwargs.get("ir_mode", "post") != "post":
+        return False
+    return True
+
+
+def simulate(simconfig, engine="auto", **simkwargs):
+    """Run simconfig with the fastest engine that covers it.
+
+    engine is "convolution", "grid" (Simulation) or "auto", which picks the
+    convolution engine whenever convolution_applies; grid-only options such
+    as solver or xunits are then not needed and are ignored.
+    """
+    if engine == "auto":
+        engine = "convolution" if convolution_applies(simconfig, simkwargs) else "grid"
+    if engine == "convolution":
+        return ConvolutionSimulation(simconfig, **{k: v for k, v in simkwargs.items() if k in SHARED_OPTIONS})
+    return Simulation(simconfig, **simkwargs)
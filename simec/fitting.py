@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Fitting of kinetic parameters to experimental voltammograms.
+Least-squares (Levenberg-Marquardt) fit of simulation parameters to an
+experimental curve, with the Jacobian simulations run in parallel.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from expdata import GetData
+from simulation import SIMCONFIG_FIELDS
+from convolution import simulate
+from sweep import with_params
+
+# parameters that can be fitted; rate constants are fitted on a log10 scale
+# so they stay positive
+FIT_PARAMS = ("Eform", "ko", "alpha", "kcf", "kcr", "Cdl", "ru")
+LOG_PARAMS = ("ko", "kcf", "kcr")
+
+
+def sweep_branches(potential, count=None):
+    # start indices of the monotonic branches of a sweep, plus the end; with
+    # count, a measured (noisy) sweep is split into count branches at its
+    # extremes, each searched around the point where evenly timed branches
+    # would turn
+    if count is None:
+        direction = np.sign(np.diff(potential))
+        turns = np.nonzero(direction[1:] * direction[:-1] < 0)[0] + 1
+        return [0] + list(turns) + [len(potential) - 1]
+    bounds = [0]
+    size = len(potential) / count
+    for k in range(1, count):
+        low = max(bounds[-1] + 1, int(round((k - 0.5) * size)))
+        high = min(len(potential) - 1, int(round((k + 0.5) * size)))
+        window = potential[low:high + 1]
+        upward = potential[low] > potential[bounds[-1]]
+        bounds.append(low + int(window.argmax() if upward else window.argmin()))
+    return bounds + [len(potential) - 1]
+
+
+def simulated_current(simconfig, simkwargs, expx):
+    # simulated current in uA at the experimental points expx: interpolated
+    # on the applied potential, branch by branch of the sweep, or on the
+    # time (expx) for chronoamperometry
+    result = simulate(simconfig, **simkwargs).get_data()
+    current = np.asarray(result.current) * 1e6
+    values = dict(zip(SIMCONFIG_FIELDS, simconfig))
+    if values["technique"] == "Chronoamperometry":
+        if expx[0] < result.time[0] - 1e-9 or expx[-1] > result.time[-1] + 1e-9:
+            raise ValueError("The experimental times are outside the simulated ones")
+        return np.interp(expx, result.time, current)
+
+    # the potentials of the result carry the iR drop, unless it is coupled
+    potential = np.asarray(result.potential)
+    if simkwargs.get("ir_mode", "post") == "post":
+        potential = potential - values["ru"] * np.asarray(result.current)
+    simbounds = sweep_branches(potential)
+    expbounds = sweep_branches(expx, len(simbounds) - 1)
+    tolerance = 1e-6 + np.abs(np.diff(potential)).max()
+    curve = np.empty(len(expx))
+    for k in range(len(simbounds) - 1):
+        E = potential[simbounds[k]:simbounds[k + 1] + 1]
+        i = current[simbounds[k]:simbounds[k + 1] + 1]
+        x = expx[expbounds[k]:expbounds[k + 1] + 1]
+        if x.min() < E.min() - tolerance or x.max() > E.max() + tolerance:
+            raise ValueError("The experimental potentials (%.4g .. %.4g V) are outside the simulated sweep "
+                             "%d (%.4g .. %.4g V)" % (x.min(), x.max(), k + 1, E.min(), E.max()))
+        if E[-1] < E[0]:
+            E, i = E[::-1], i[::-1]
+        curve[expbounds[k]:expbounds[k + 1] + 1] = np.interp(x, E, i)
+    return curve
+
+
+class Fit():
+    """Fit of simconfig parameters to an experimental curve.
+
+    expdata is a CSV file name (read with expdata.GetData) or a pair of
+    (potential, current in uA) sequences, or (time, current in uA) for
+    chronoamperometry. The simulated current is interpolated onto the
+    experimental potentials, which must lie within the simulated program
+    (ValueError otherwise). After fit(), values holds the fitted
+    parameters, intervals their 95% confidence intervals, and walltime,
+    simulations and iterations the cost of the fit.
+    """
+
+    def __init__(self, simconfig, expdata, params=("Eform", "ko", "alpha"), workers=None, **simkwargs):
+        for name in params:
+            if name not in FIT_PARAMS:
+                raise ValueError("Cannot fit parameter: %s" % name)
+        if isinstance(expdata, str):
+            expdata = GetData(expdata).get_data()
+        self.expx = np.asarray(expdata[0], dtype=float)
+        self.expy = np.asarray(expdata[1], dtype=float)
+
+        self.simconfig = list(simconfig)
+        self.params = tuple(params)
+        self.workers = workers
+        self.simkwargs = dict(simkwargs)
+        self.simkwargs.setdefault("storage", "rolling")
+        self.cache = {}
+        self.simulations = 0
+        self.executor = None
+
+        # fitting coordinates: log10 for positive rate constants
+        self.logscale = [name in LOG_PARAMS and self.start(name) > 0 for name in self.params]
+
+    def start(self, name):
+        return float(self.simconfig[SIMCONFIG_FIELDS.index(name)])
+
+    def to_params(self, p):
+        return {name: float(10 ** v if log else v) for name, v, log in zip(self.params, p, self.logscale)}
+
+    def evaluate(self, points):
+        # simulated curves for several points in fitting coordinates; repeated
+        # points come from the cache and the rest run in parallel
+        keys = [tuple(np.round(p, 12)) for p in points]
+        missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        configs = [with_params(self.simconfig, self.to_params(key)) for key in missing]
+        args = ([self.simkwargs] * len(configs), [self.expx] * len(configs))
+        if self.executor is not None and len(configs) > 1:
+            curves = self.executor.map(simulated_current, configs, *args)
+        else:
+            curves = map(simulated_current, configs, *args)
+        for key, curve in zip(missing, curves):
+            self.cache[key] = curve
+        self.simulations += len(missing)
+        return [self.cache[key] for key in keys]
+
+    def jacobian(self, p):
+        # forward differences, one simulation per parameter
+        steps = np.where(self.logscale, 1e-3, 1e-4 * np.maximum(np.abs(p), 1))
+        points = [p] + [p + step * np.eye(len(p))[k] for k, step in enumerate(steps)]
+        curves = self.evaluate(points)
+        return np.array([(curve - curves[0]) / step for curve, step in zip(curves[1:], steps)]).T
+
+    def fit(self, maxiter=30, tol=1e-8):
+        starttime = time.perf_counter()
+        if self.workers != 1:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            p = np.array([np.log10(self.start(name)) if log else self.start(name)
+                          for name, log in zip(self.params, self.logscale)])
+            r = self.evaluate([p])[0] - self.expy
+            cost = r @ r
+            damping = 1e-3
+            self.iterations = 0
+
+            for self.iterations in range(1, maxiter + 1):
+                J = self.jacobian(p)
+                A = J.T @ J
+                g = J.T @ r
+                while damping < 1e10:
+                    delta = np.linalg.lstsq(A + damping * np.diag(np.diag(A) + 1e-30), -g, rcond=None)[0]
+                    trial = p + delta
+                    if "alpha" in self.params:
+                        k = self.params.index("alpha")
+                        trial[k] = np.clip(trial[k], 0.01, 0.99)
+                    rtrial = self.evaluate([trial])[0] - self.expy
+                    if rtrial @ rtrial < cost:
+                        break
+                    damping *= 10
+                else:
+                    break
+                improvement = (cost - rtrial @ rtrial) / max(cost, 1e-300)
+                p, r, cost = trial, rtrial, rtrial @ rtrial
+                damping = max(damping / 10, 1e-12)
+                if improvement < tol or np.all(np.abs(delta) < tol * (np.abs(p) + tol)):
+                    break
+
+            # confidence intervals from the covariance at the optimum
+            J = self.jacobian(p)
+            dof = max(len(r) - len(p), 1)
+            covariance = np.linalg.pinv(J.T @ J) * cost / dof
+            halfwidth = 1.96 * np.sqrt(np.abs(np.diag(covariance)))
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+        self.values = self.to_params(p)
+        self.intervals = {}
+        for name, low, high in zip(self.params, self.to_params(p - halfwidth).values(),
+                                   self.to_params(p + halfwidth).values()):
+            self.intervals[name] = (low, high)
+        self.residual = np.sqrt(cost / len(r))
+        self.current = r + self.expy
+        self.walltime = time.perf_counter() - starttime
+        return self
+
+    def report(self):
+        lines = ["%-6s %12.5g  (95%%: %.5g .. %.5g)" % (name, self.values[name], *self.intervals[name])
+                 for name in self.params]
+        lines.append("rms residual: %.5g uA" % self.residual)
+        lines.append("%d iterations, %d simulations, %.2f s" % (self.iterations, self.simulations, self.walltime))
+        return "\n".join(lines)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Background simulation jobs for the interface.
+JobManager runs queued simulations one after another on a worker thread and
+reports their progress and outcome through Qt signals, so the main window
+keeps responding while they run and any job can be cancelled.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import threading
+import traceback
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class Cancelled(Exception):
+    """Raised from the progress callback of a cancelled job to stop it."""
+
+
+class JobSignals(QObject):
+    # progress(job, step, steps); finished(job, result, context);
+    # failed(job, message); cancelled(job); pending(jobs queued or running)
+    progress = pyqtSignal(int, int, int)
+    finished = pyqtSignal(int, object, object)
+    failed = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+    pending = pyqtSignal(int)
+
+
+class SimulationJob(QRunnable):
+    # one call of run(simconfig, progress) on the worker thread; exactly one
+    # of finished, failed or cancelled is emitted for it
+    def __init__(self, number, run, simconfig, context, signals):
+        QRunnable.__init__(self)
+        self.setAutoDelete(False)
+        self.number = number
+        self.run_simulation = run
+        self.simconfig = simconfig
+        self.context = context
+        self.signals = signals
+        self.cancel_event = threading.Event()
+
+    def progress(self, step, steps):
+        if self.cancel_event.is_set():
+            raise Cancelled()
+        self.signals.progress.emit(self.number, step, steps)
+
+    def run(self):
+        try:
+            if self.cancel_event.is_set():
+                raise Cancelled()
+            result = self.run_simulation(self.simconfig, self.progress)
+        except Cancelled:
+            self.signals.cancelled.emit(self.number)
+        except Exception:
+            self.signals.failed.emit(self.number, traceback.format_exc())
+        else:
+            self.signals.finished.emit(self.number, result, self.context)
+
+
+class JobManager(QObject):
+    """Queue of simulation jobs run in order on one worker thread.
+
+    run(simconfig, progress) computes a result (e.g. ResultPipeline.run) and
+    is only ever called from the worker thread, one job at a time. submit()
+    returns the number of the job; context is passed back with its result.
+    The signals are delivered on the thread of the manager (the interface).
+    """
+
+    def __init__(self, run, parent=None):
+        QObject.__init__(self, parent)
+        self.run = run
+        self.signals = JobSignals()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.jobs = {}
+        self.count = 0
+        for signal in (self.signals.finished, self.signals.failed, self.signals.cancelled):
+            signal.connect(self.done)
+
+    def submit(self, simconfig, context=None):
+        self.count += 1
+        job = SimulationJob(self.count, self.run, simconfig, context, self.signals)
+        self.jobs[job.number] = job
+        self.pool.start(job)
+        self.signals.pending.emit(len(self.jobs))
+        return job.number
+
+    def cancel(self, number=None):
+        # cancel one job, or all of them; a running job stops at its next
+        # progress report, a queued one as soon as it starts
+        if number is None:
+            jobs = list(self.jobs.values())
+        else:
+            jobs = [self.jobs[number]] if number in self.jobs else []
+        for job in jobs:
+            job.cancel_event.set()
+
+    def done(self, number, *args):
+        self.jobs.pop(number, None)
+        self.signals.pending.emit(len(self.jobs))
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Declarative reaction mechanisms.
+A mechanism lists its species, the electron transfers at the electrode and
+the homogeneous reactions in solution, and compiles once into the arrays the
+simulation steppers use, so new mechanisms need no changes to the time loop.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import numpy as np
+
+
+class Species():
+    def __init__(self, name, D, bulk=0.0):
+        self.name = name
+        self.D = D
+        self.bulk = bulk
+
+
+class ElectronTransfer():
+    # ox + n e- <=> red at the electrode, with Butler-Volmer kinetics
+    def __init__(self, ox, red, n, Eform, ko, alpha):
+        self.ox = ox
+        self.red = red
+        self.n = n
+        self.Eform = Eform
+        self.ko = ko
+        self.alpha = alpha
+
+
+class Reaction():
+    # reactants <=> products in solution; each direction is first order
+    # (one species) or second order (two species)
+    def __init__(self, reactants, products, kf, kr=0.0):
+        self.reactants = tuple(reactants)
+        self.products = tuple(products)
+        self.kf = kf
+        self.kr = kr
+
+
+class Mechanism():
+    def __init__(self, species, transfers, reactions=()):
+        self.species = list(species)
+        self.transfers = list(transfers)
+        self.reactions = list(reactions)
+
+    def compile(self):
+        return CompiledMechanism(self)
+
+
+class CompiledMechanism():
+    """Arrays for the steppers, indexed by species s and electron transfer k.
+
+    D and bulk are (S,); rates is the first-order rate matrix (S, S) with
+    dc/dt = rates @ c; the second-order terms add second_rates[q] *
+    c[i_q] * c[j_q] * second_stoich[q] for each pair in second_pairs; nu
+    (S, K) is +1 for the oxidised and -1 for the reduced species of each
+    electron transfer; n, Eform, ko and alpha are (K,).
+    """
+
+    def __init__(self, mechanism):
+        self.species = tuple(s.name for s in mechanism.species)
+        index = {name: i for i, name in enumerate(self.species)}
+        size = len(self.species)
+        self.D = np.array([s.D for s in mechanism.species], dtype=float)
+        self.bulk = np.array([s.bulk for s in mechanism.species], dtype=float)
+
+        self.rates = np.zeros((size, size))
+        pairs, rates, stoich = [], [], []
+        for reaction in mechanism.reactions:
+            for reactants, products, k in ((reaction.reactants, reaction.products, reaction.kf),
+                                           (reaction.products, reaction.reactants, reaction.kr)):
+                if k == 0:
+                    continue
+                change = np.zeros(size)
+                for name in reactants:
+                    change[index[name]] -= 1
+                for name in products:
+                    change[index[name]] += 1
+                if len(reactants) == 1:
+                    self.rates[:, index[reactants[0]]] += k * change
+                elif len(reactants) == 2:
+                    pairs.append((index[reactants[0]], index[reactants[1]]))
+                    rates.append(k)
+                    stoich.append(change)
+                else:
+                    raise ValueError("Only first- and second-order reactions are supported")
+        self.second_pairs = tuple(pairs)
+        self.second_rates = np.array(rates, dtype=float)
+        self.second_stoich = np.array(stoich, dtype=float).reshape(-1, size)
+
+        transfers = mechanism.transfers
+        self.oxidised = np.array([index[t.ox] for t in transfers])
+        self.reduced = np.array([index[t.red] for t in transfers])
+        self.nu = np.zeros((size, len(transfers)))
+        self.nu[self.oxidised, np.arange(len(transfers))] += 1
+        self.nu[self.reduced, np.arange(len(transfers))] -= 1
+        self.n = np.array([t.n for t in transfers], dtype=float)
+        self.Eform = np.array([t.Eform for t in transfers], dtype=float)
+        self.ko = np.array([t.ko for t in transfers], dtype=float)
+        self.alpha = np.array([t.alpha for t in transfers], dtype=float)
+
+    def rate_constants(self, E, temp):
+        # Butler-Volmer rate constants (kf, kb) for every electron transfer at
+        # potential(s) E; the transfers run along the last axis
+        f = self.n * 96485 / (8.31451 * temp)
+        eta = np.asarray(E)[..., None] - self.Eform
+        return self.ko * np.exp(-self.alpha * f * eta), self.ko * np.exp((1 - self.alpha) * f * eta)
+
+    def reaction_rates(self, c):
+        # dc/dt from the second-order reactions for concentrations shaped
+        # (..., species, distance)
+        result = np.zeros(c.shape)
+        for (i, j), k, change in zip(self.second_pairs, self.second_rates.T, self.second_stoich):
+            result += (np.asarray(k)[..., None] * c[..., i, :] * c[..., j, :])[..., None, :] * change[:, None]
+        return result
+
+    @classmethod
+    def stack(cls, compiled):
+        # batch of compiled mechanisms with the same species and reactions;
+        # the per-config numbers gain a leading batch axis
+        first = compiled[0]
+        for other in compiled[1:]:
+            if other.species != first.species or other.second_pairs != first.second_pairs or \
+                    not np.array_equal(other.nu, first.nu):
+                raise ValueError("A batch must share one mechanism structure")
+        batch = cls.__new__(cls)
+        batch.__dict__.update(first.__dict__)
+        for name in ("D", "bulk", "rates", "second_rates", "n", "Eform", "ko", "alpha"):
+            setattr(batch, name, np.array([getattr(c, name) for c in compiled]))
+        return batch
+
+
+def legacy(values, cox_bulk, cchem_bulk, reactions, chem=True):
+    # ox, red and chem species shared by the EC, ECat and CE mechanisms;
+    # without chem, only ox and red (E)
+    species = [Species("ox", values["D"], cox_bulk), Species("red", values["D2"])]
+    if chem:
+        species.append(Species("chem", values["D"], cchem_bulk))
+    transfers = [ElectronTransfer("ox", "red", values["n"], values["Eform"], values["ko"], values["alpha"])]
+    return Mechanism(species, transfers, reactions)
+
+
+def mechanism_e(values, chem=False):
+    # ox + e <=> red; chem: with an idle chem species, to batch it with the
+    # EC, ECat and CE mechanisms
+    return legacy(values, values["conc_bulk"], 0, [], chem)
+
+
+def mechanism_ec(values):
+    # ox + e <=> red; red <=> chem
+    return legacy(values, values["conc_bulk"], 0, [Reaction(["red"], ["chem"], values["kcf"], values["kcr"])])
+
+
+def mechanism_ecat(values):
+    # ox + e <=> red; red <=> chem; as in the original scheme, red also
+    # regenerates ox at kcf (catalysis) and ox decays at kcr
+    kcf, kcr = values["kcf"], values["kcr"]
+    return legacy(values, values["conc_bulk"], 0, [Reaction(["red"], ["chem"], kcf, kcr),
+                                                   Reaction(["red"], ["red", "ox"], kcf),
+                                                   Reaction(["ox"], [], kcr)])
+
+
+def mechanism_ce(values):
+    # chem <=> ox, pre-equilibrated in the bulk; ox + e <=> red
+    kcf, kcr = values["kcf"], values["kcr"]
+    cchem_bulk = values["conc_bulk"] / (1 + kcf / kcr) if kcr != 0 else 0
+    return legacy(values, values["conc_bulk"] - cchem_bulk, cchem_bulk,
+                  [Reaction(["chem"], ["ox"], kcf, kcr)])
+
+
+def mechanism_ee(values):
+    # ox + e <=> red; red + e <=> red2
+    species = [Species("ox", values["D"], values["conc_bulk"]), Species("red", values["D2"]),
+               Species("red2", values["D2"])]
+    transfers = [ElectronTransfer("ox", "red", values["n"], values["Eform"], values["ko"], values["alpha"]),
+                 ElectronTransfer("red", "red2", values["n2"], values["Eform2"], values["ko2"], values["alpha2"])]
+    return Mechanism(species, transfers)
+
+
+def mechanism_ece(values):
+    # ox + e <=> red; red <=> chem; chem + e <=> red2
+    species = [Species("ox", values["D"], values["conc_bulk"]), Species("red", values["D2"]),
+               Species("chem", values["D"]), Species("red2", values["D2"])]
+    transfers = [ElectronTransfer("ox", "red", values["n"], values["Eform"], values["ko"], values["alpha"]),
+                 ElectronTransfer("chem", "red2", values["n2"], values["Eform2"], values["ko2"], values["alpha2"])]
+    return Mechanism(species, transfers, [Reaction(["red"], ["chem"], values["kcf"], values["kcr"])])
+
+
+def mechanism_ecec(values):
+    # ox + e <=> red; red <=> chem; chem + e <=> red2; red2 <=> chem2
+    species = [Species("ox", values["D"], values["conc_bulk"]), Species("red", values["D2"]),
+               Species("chem", values["D"]), Species("red2", values["D2"]), Species("chem2", values["D"])]
+    transfers = [ElectronTransfer("ox", "red", values["n"], values["Eform"], values["ko"], values["alpha"]),
+                 ElectronTransfer("chem", "red2", values["n2"], values["Eform2"], values["ko2"], values["alpha2"])]
+    return Mechanism(species, transfers, [Reaction(["red"], ["chem"], values["kcf"], values["kcr"]),
+                                          Reaction(["red2"], ["chem2"], values["kcf2"], values["kcr2"])])
+
+
+# mechanism name -> builder taking the simconfig values by field name, plus
+# the second-step parameters (n2, Eform2, ko2, alpha2, kcf2, kcr2)
+MECHANISMS = {"E": mechanism_e, "EC": mechanism_ec, "ECat": mechanism_ecat, "CE": mechanism_ce,
+              "EE": mechanism_ee, "ECE": mechanism_ece, "ECEC": mechanism_ecec}
+
+
+def build_mechanism(values, extra=None):
+    # compiled mechanism for simconfig values given by field name; the
+    # second-step parameters default to those of the first step
+    values = dict(values)
+    for name in ("n", "Eform", "ko", "alpha", "kcf", "kcr"):
+        values.setdefault(name + "2", values[name])
+    values.update(extra or {})
+    mechanism = values["mechanism"]
+    if isinstance(mechanism, Mechanism):
+        return mechanism.compile()
+    if mechanism not in MECHANISMS:
+        raise ValueError("Unknown mechanism: %s" % mechanism)
+    return MECHANISMS[mechanism](values).compile()
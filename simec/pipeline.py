@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Staged evaluation of simulation results.
+The faradaic solve is separated from the post-processing (charging current,
+baseline shift and iR drop), so changing only a post-processing parameter
+recomputes only the stages that depend on it.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import json
+import numpy as np
+from simulation import SIMCONFIG_FIELDS, default_waveform, charging_current
+from cache import SimulationCache, canonical
+from result import SimulationResult
+
+# POSTPROCESSING_FIELDS: simconfig entries that do not enter the faradaic
+# solve; they are set to zero for it and applied afterwards
+POSTPROCESSING_FIELDS = ("Cdl", "shift", "ru")
+
+
+class ResultPipeline():
+    """Simulation results computed in stages, each redone only when its
+    inputs change.
+
+    faradaic: the simulation with Cdl, shift and ru set to zero (through the
+    cache, so it is also shared with earlier runs); charging: double layer
+    current, from the waveform, area and Cdl; current: faradaic plus
+    charging current plus the shift; potential: applied potential plus the
+    iR drop. After run(), recomputed lists the stages that were evaluated.
+    """
+
+    def __init__(self, cache=None, engine="auto", **simkwargs):
+        self.cache = cache if cache is not None else SimulationCache()
+        self.engine = engine
+        self.simkwargs = simkwargs
+        self.stages = {}
+        self.recomputed = []
+
+    def stage(self, name, inputs, compute):
+        # value of stage name, recomputed only if inputs differ from the
+        # ones it was last computed with
+        key = json.dumps(canonical(inputs), sort_keys=True)
+        if name not in self.stages or self.stages[name][0] != key:
+            self.stages[name] = (key, compute())
+            self.recomputed.append(name)
+        return self.stages[name][1]
+
+    def run(self, simconfig, progress=None):
+        # SimulationResult for simconfig, as Simulation.get_data; progress
+        # as in Simulation, for the faradaic solve when it is simulated
+        values = dict(zip(SIMCONFIG_FIELDS, simconfig))
+        # with the coupled iR drop, Cdl and ru enter the solve and only the
+        # shift is left to post-process
+        coupled = self.simkwargs.get("ir_mode") == "coupled"
+        postfields = ("shift",) if coupled else POSTPROCESSING_FIELDS
+        solveconfig = [0.0 if name in postfields else value for name, value in values.items()]
+        self.recomputed = []
+
+        solved = self.stage("faradaic", solveconfig,
+                            lambda: self.cache.run(solveconfig, self.engine, progress=progress, **self.simkwargs))
+        time = solved.time
+
+        def charging():
+            if coupled:
+                return np.zeros(len(time))
+            waveform = self.simkwargs.get("waveform") or default_waveform(simconfig, self.simkwargs.get("cycles", 1))
+            capcurrent = charging_current(waveform, time, values["area"], values["Cdl"])
+            # no charging current at t = 0, as in Simulation
+            return np.where(time > 0, capcurrent, 0.0)
+
+        capcurrent = self.stage("charging", [solveconfig, values["area"], values["Cdl"]], charging)
+        current = self.stage("current", [solveconfig, values["Cdl"], values["shift"]],
+                             lambda: solved.current + capcurrent + 1e-6 * values["shift"])
+        potential = self.stage("potential", [solveconfig, values["Cdl"], values["shift"], values["ru"]],
+                               lambda: solved.potential + (0.0 if coupled else values["ru"]) * current)
+        return SimulationResult(time, potential, current, solved.distance, solved.conc, solved.species,
+                                solved.conc_time)
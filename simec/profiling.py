@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Phase profiling of simulation runs.
+A Profiler collects the wall time, calls, steps and (optionally) memory
+allocations of the named phases of a run, so a slow run can be traced to
+the phase that slowed down without an external profiler.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import time
+import contextlib
+import tracemalloc
+
+
+class Profiler():
+    """Totals per phase name, in order of first use.
+
+    phases[name] is a dict with seconds, calls and steps, and with memory=True
+    also allocated (bytes still held at the end of the phase, added over its
+    calls) and peak (largest memory in use above the start of one call),
+    from tracemalloc; if it is not tracing yet, it is started for each
+    phase and stopped again at its end, so later runs are not traced.
+    callback, if given, is called as callback(name, record) at the end of
+    each phase with the record of that call alone.
+    Phases measured with memory should not be nested.
+    """
+
+    def __init__(self, callback=None, memory=False):
+        self.callback = callback
+        self.memory = memory
+        self.phases = {}
+
+    def record(self, name):
+        if name not in self.phases:
+            self.phases[name] = {"seconds": 0.0, "calls": 0, "steps": 0}
+            if self.memory:
+                self.phases[name].update(allocated=0, peak=0)
+        return self.phases[name]
+
+    def add(self, name, record):
+        total = self.record(name)
+        for field, value in record.items():
+            total[field] = max(total[field], value) if field == "peak" else total[field] + value
+        if self.callback is not None:
+            self.callback(name, record)
+
+    @contextlib.contextmanager
+    def phase(self, name, steps=0):
+        # times the block as phase name; steps: number of steps it covers,
+        # which the block can also set in the record dict it gets
+        record = {"steps": steps}
+        started = self.memory and not tracemalloc.is_tracing()
+        if self.memory:
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.update(seconds=time.perf_counter() - start, calls=1)
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record.update(allocated=current - before, peak=peak - before)
+            if started:
+                tracemalloc.stop()
+            self.add(name, record)
+
+    def timed(self, name, function):
+        # function wrapped to add the time of every call to phase name; for
+        # calls too short and many to trace memory or report one by one
+        total = self.record(name)
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                total["seconds"] += time.perf_counter() - start
+                total["calls"] += 1
+        return wrapper
+
+    def __str__(self):
+        lines = ["%-16s %10s %8s %8s" % ("phase", "seconds", "calls", "steps")]
+        lines += ["%-16s %10.4f %8d %8d" % (name, p["seconds"], p["calls"], p["steps"]) +
+                  ("  %.2f MiB held, %.2f MiB peak" % (p["allocated"] / 2 ** 20, p["peak"] / 2 ** 20)
+                   if "peak" in p else "") for name, p in self.phases.items()]
+        return "\n".join(lines)
+
+
+def phase(profiler, name, steps=0):
+    # profiler.phase, or nothing when there is no profiler
+    return profiler.phase(name, steps) if profiler is not None else contextlib.nullcontext({"steps": steps})
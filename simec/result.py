@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Simulation results.
+SimulationResult keeps the time, potential and current of a run in one
+contiguous array and the concentration profiles in another, and unpacks
+like the simdata list of get_data.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import numpy as np
+
+# SIMDATA_FIELDS: order of the entries when a result is unpacked or indexed
+SIMDATA_FIELDS = ("potential", "current", "distance", "time", "cox", "cred", "cchem")
+
+
+class SimulationResult():
+    """Results of one run.
+
+    table: contiguous (3, N) array whose rows are time, potential and
+    current; time, potential and current are views of it, and memoryview()
+    or np.asarray() export it without copying. conc: contiguous (M, S, X)
+    concentrations of species at distance for the M times in conc_time
+    (all the times, or only the snapshots), or None; cox, cred and cchem are
+    views of it made on access. dtype is float64 or float32. profiler: the
+    profiling.Profiler of the run, if it was profiled.
+    """
+
+    def __init__(self, time, potential, current, distance, conc=None, species=(), conc_time=None,
+                 dtype=np.float64):
+        self.table = np.empty((3, len(time)), dtype=dtype)
+        self.table[0] = time
+        self.table[1] = potential
+        self.table[2] = current
+        self.distance = np.ascontiguousarray(distance, dtype=dtype)
+        self.conc = None if conc is None else np.ascontiguousarray(conc, dtype=dtype)
+        self.species = tuple(species)
+        self.conc_time = self.time if conc_time is None else np.ascontiguousarray(conc_time, dtype=dtype)
+        # profiler: profiling.Profiler of the run, when it was profiled
+        self.profiler = None
+
+    @property
+    def time(self):
+        return self.table[0]
+
+    @property
+    def potential(self):
+        return self.table[1]
+
+    @property
+    def current(self):
+        return self.table[2]
+
+    def concentration(self, name):
+        # profiles of species name over time, or None if it is not simulated
+        if self.conc is None or name not in self.species:
+            return None
+        return self.conc[:, self.species.index(name)]
+
+    @property
+    def cox(self):
+        return self.concentration("ox")
+
+    @property
+    def cred(self):
+        return self.concentration("red")
+
+    @property
+    def cchem(self):
+        return self.concentration("chem")
+
+    # unpacking and indexing as the simdata list:
+    # potential, current, distance, time, cox, cred, cchem = result
+    def __iter__(self):
+        return (getattr(self, name) for name in SIMDATA_FIELDS)
+
+    def __len__(self):
+        return len(SIMDATA_FIELDS)
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.table if dtype is None else self.table.astype(dtype)
+
+    def __buffer__(self, flags):
+        return memoryview(self.table)
+
+    def buffer(self):
+        # zero-copy view of table for any consumer of the buffer protocol
+        return memoryview(self.table)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes + self.distance.nbytes + (0 if self.conc is None else self.conc.nbytes)
+
+    def astype(self, dtype):
+        return SimulationResult(self.time, self.potential, self.current, self.distance, self.conc, self.species,
+                                self.conc_time, dtype)
+
+    def index_at_time(self, t):
+        # index of the time closest to t (scalar or array)
+        return self.nearest(self.time, t)
+
+    def index_at_potential(self, E, branch=None):
+        # index of the potential closest to E, only among the points where
+        # the potential goes up (branch="anodic") or down ("cathodic") if
+        # asked for
+        candidates = np.arange(len(self.time))
+        if branch is not None:
+            slope = np.gradient(self.potential)
+            candidates = candidates[slope > 0 if branch == "anodic" else slope < 0]
+        nearest = np.abs(self.potential[candidates] - np.asarray(E, dtype=float)[..., None]).argmin(axis=-1)
+        index = candidates[nearest]
+        return index if index.ndim else int(index)
+
+    def current_at(self, t):
+        # current interpolated at time(s) t
+        return np.interp(t, self.time, self.current)
+
+    def profile(self, name, t):
+        # concentration profile of species name at the stored time closest
+        # to t; a view of conc
+        return self.concentration(name)[self.nearest(self.conc_time, t)]
+
+    @staticmethod
+    def nearest(values, x):
+        x = np.asarray(x, dtype=float)
+        if len(values) == 1:
+            return np.zeros(x.shape, dtype=int) if x.ndim else 0
+        i = np.clip(np.searchsorted(values, x), 1, len(values) - 1)
+        i = i - (np.abs(x - values[i - 1]) <= np.abs(values[i] - x))
+        return i if i.ndim else int(i)
+
+    @classmethod
+    def concatenate(cls, results):
+        # one result from consecutive ones (e.g. the chunks of a
+        # SimulationStream); concentrations are kept if all of them have them
+        results = list(results)
+        first = results[0]
+        conc = None
+        if all(r.conc is not None for r in results):
+            conc = np.concatenate([r.conc for r in results])
+        return cls(np.concatenate([r.time for r in results]), np.concatenate([r.potential for r in results]),
+                   np.concatenate([r.current for r in results]), first.distance, conc, first.species,
+                   np.concatenate([r.conc_time for r in results]) if conc is not None else None, first.table.dtype)
+
+    def arrays(self):
+        # the arrays to save, by name
+        arrays = {"table": self.table, "distance": self.distance, "conc_time": self.conc_time,
+                  "species": np.array(self.species, dtype=str)}
+        if self.conc is not None:
+            arrays["conc"] = self.conc
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        table = arrays["table"]
+        return cls(table[0], table[1], table[2], arrays["distance"], arrays.get("conc"),
+                   [str(name) for name in arrays["species"]], arrays["conc_time"], table.dtype)
@@ -20,14 +20,44 @@ __license__ = "GPLv3"
 __program__ = "simEC"
 __version__ = "0.1"
 
+import os
 import sys
 import inspect
-from distutils.dist import strtobool
-from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QComboBox, QLineEdit, QCheckBox, QRadioButton
+from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QComboBox, QLineEdit, QCheckBox, QRadioButton, \
+    QPushButton, QProgressBar
 from PyQt5.QtCore import QSize, QPoint, QSettings
 from ui_mainwindow import Ui_MainWindow
-from simwindow import SimWindow
-from simulation import Simulation
+from jobs import JobManager
+
+# Only Qt and the main window are imported at startup; the simulation modules
+# (numpy) are imported on the first run and the plotting window (matplotlib)
+# when it first opens, so the main window appears sooner
+
+# FIGS_DIRECTORY: pictures of the mechanisms, read when they are shown; the
+# compiled resources (pics_rc) are only loaded if the files are not there
+FIGS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "figs")
+MECHANISM_FIGS = {"E": "E.png", "EC": "EC.png", "ECE": "ECE.png"}
+
+
+def strtobool(value):
+    # stored QSettings booleans ("true"/"false") as 1/0, as distutils did
+    value = str(value).lower()
+    if value in ("y", "yes", "t", "true", "on", "1"):
+        return 1
+    if value in ("n", "no", "f", "false", "off", "0"):
+        return 0
+    raise ValueError("invalid truth value %r" % value)
+
+
+def mechanism_image(mechanism):
+    # rich text showing the picture of mechanism
+    path = os.path.join(FIGS_DIRECTORY, MECHANISM_FIGS[mechanism])
+    if os.path.exists(path):
+        source = path.replace(os.sep, "/")
+    else:
+        import pics_rc
+        source = ":/figs/" + MECHANISM_FIGS[mechanism]
+    return "<html><head/><body><p><img src=\"%s\"/></p></body></html>" % source
 
 
 class MainWindow (QMainWindow):
@@ -40,6 +70,27 @@ class MainWindow (QMainWindow):
 
         self.settings = QSettings("simEC")
 
+        # pipeline: results of previous runs, so Run with unchanged parameters
+        # does not simulate again and changing only Cdl, shift or Ru only
+        # redoes the post-processing; made on the first run
+        self.pipeline = None
+
+        # jobs: simulations queued with Run, computed on a worker thread; the
+        # status bar shows the progress of the running one, and Cancel stops
+        # it and the queued ones
+        self.jobs = JobManager(self.computeSimulation, self)
+        self.jobs.signals.progress.connect(self.jobProgress)
+        self.jobs.signals.finished.connect(self.jobFinished)
+        self.jobs.signals.failed.connect(self.jobFailed)
+        self.jobs.signals.cancelled.connect(self.jobCancelled)
+        self.jobs.signals.pending.connect(self.jobsPending)
+        self.progressBar = QProgressBar()
+        self.cancelButton = QPushButton("Cancel")
+        self.cancelButton.clicked.connect(lambda: self.jobs.cancel())
+        self.statusBar().addPermanentWidget(self.progressBar)
+        self.statusBar().addPermanentWidget(self.cancelButton)
+        self.jobsPending(0)
+
     def setupMainWindow(self):
         self.tabWidget = self.ui.tabWidget
         self.tabMechanism = self.ui.tabMechanism
@@ -54,6 +105,7 @@ class MainWindow (QMainWindow):
         self.comboMechanism = self.ui.comboMechanism
         self.comboMechanism.activated[str].connect(self.mechanismSelected)
         self.mechanismImg = self.ui.mechanismImg
+        self.mechanismSelected(self.comboMechanism.currentText())
 
         self.techniqueCB = self.ui.techniqueCB
         self.techniqueCB.activated[str].connect(self.techniqueSelected)
@@ -126,18 +178,14 @@ class MainWindow (QMainWindow):
         self.actionQuit.triggered.connect(self.quitApp)
 
     def quitApp(self):
-        app.quit()
+        # close first, so the running jobs are cancelled and waited for
+        # (closeEvent) before the event loop stops
+        if self.close():
+            app.quit()
 
     def mechanismSelected(self, mechanism):
-        if mechanism == "E":
-            #print("E")
-            self.mechanismImg.setText("<html><head/><body><p><img src=\":/figs/E.png\"/></p></body></html>")
-        elif mechanism == "EC":
-            #print("EC")
-            self.mechanismImg.setText("<html><head/><body><p><img src=\":/figs/EC.png\"/></p></body></html>")
-        elif mechanism == "ECE":
-            #print("ECE")
-            self.mechanismImg.setText("<html><head/><body><p><img src=\":/figs/ECE.png\"/></p></body></html>")
+        if mechanism in MECHANISM_FIGS:
+            self.mechanismImg.setText(mechanism_image(mechanism))
 
 
     def techniqueSelected(self, technique):
@@ -152,13 +200,19 @@ class MainWindow (QMainWindow):
 
     def runSimulation(self):
         print("run simulation")
-        simconfig = self.getSimConfig()
-
-        # Perform simulation
-        simulation = Simulation(simconfig)
-        simdata = simulation.get_data()
-
-        # Show plots in new widget
+        try:
+            simconfig = self.getSimConfig()
+        except ValueError as error:
+            self.statusBar().showMessage(str(error))
+            return
+        problems = simconfig.problems()
+        if problems:
+            print("\n".join(problems))
+            self.statusBar().showMessage(problems[0])
+            return
+
+        # Plot options are read now, so changing them does not affect the
+        # jobs already queued
         static = self.staticCB.isChecked()
         firstplot = self.firstplotCB.currentText()
         #TODO: show second plot
@@ -166,11 +220,51 @@ class MainWindow (QMainWindow):
         expfile = (self.expfileline.text())
         blank = self.blankcb.isChecked()
 
+        self.jobs.submit(simconfig, (static, firstplot, expfile, blank))
+
+    def computeSimulation(self, simconfig, progress):
+        # Perform simulation, or reuse the cached result (on the worker thread)
+        if self.pipeline is None:
+            from cache import SimulationCache, CACHE_DIRECTORY
+            from pipeline import ResultPipeline
+            self.pipeline = ResultPipeline(SimulationCache(CACHE_DIRECTORY))
+        return self.pipeline.run(simconfig, progress)
+
+    def jobProgress(self, job, step, steps):
+        self.progressBar.setMaximum(steps)
+        self.progressBar.setValue(step)
+
+    def jobFinished(self, job, simdata, options):
+        # Show plots in new widget
+        from simwindow import SimWindow
+        static, firstplot, expfile, blank = options
         simwindow = SimWindow(self, simdata, static, firstplot, expfile, blank)
         simwindow.show()
 
+    def jobFailed(self, job, message):
+        print(message)
+        self.statusBar().showMessage("Simulation %d failed: %s" % (job, message.strip().splitlines()[-1]))
+
+    def jobCancelled(self, job):
+        self.statusBar().showMessage("Simulation %d cancelled" % job)
+
+    def jobsPending(self, pending):
+        # the progress bar and Cancel are shown while jobs are queued or
+        # running; Run stays enabled to queue more
+        self.progressBar.setVisible(pending > 0)
+        self.cancelButton.setVisible(pending > 0)
+        self.progressBar.setValue(0)
+        if pending:
+            self.statusBar().showMessage("%d simulation%s queued" % (pending, "s" if pending > 1 else ""))
+
+    def closeEvent(self, event):
+        self.jobs.cancel()
+        self.jobs.wait()
+        QMainWindow.closeEvent(self, event)
+
 
     def getSimConfig(self):
+        from config import SimConfig
         mechanism = self.comboMechanism.currentText()
         technique = self.techniqueCB.currentText()
         Estart = float(self.Estartline.text())
@@ -195,8 +289,8 @@ class MainWindow (QMainWindow):
         shift = float(self.shiftline.text())
         ru = float(self.Ruline.text())
 
-        simconfig = [technique, mechanism, Estart, Eswitch, scanrate, Eform, n, k0, alpha, diffcoef, diffcoef2, area,
-                     temp, conc_bulk, kcf, kcr, EstartAmp, tstart, Epulse, tpulse, Cdl, shift, ru]
+        simconfig = SimConfig(technique, mechanism, Estart, Eswitch, scanrate, Eform, n, k0, alpha, diffcoef, diffcoef2,
+                              area, temp, conc_bulk, kcf, kcr, EstartAmp, tstart, Epulse, tpulse, Cdl, shift, ru)
 
         return simconfig
 
@@ -22,176 +22,1074 @@ __version__ = "0.1"
 
 import numpy as np
 import math as mt
+from mechanisms import build_mechanism, mechanism_e, CompiledMechanism
+from waveform import Waveform
+from result import SimulationResult
+from profiling import Profiler, phase
 
-class Simulation():
-    def __init__(self, simconfig):
-        technique, mechanism, Estart, Eswitch, scanrate, Eform, n, ko, alpha, D, D2, area, temp, conc_bulk, \
-            kcf, kcr, EstartAmp, t1, Epulse, tend, Cdl, shift, ru = simconfig
+# physical constants
+F = 96485
+R = 8.31451
 
-        tunits = 1000
-        xunits = 100
-        # physical constants
-        F = 96485
-        R = 8.31451
+# simconfig: positional list of simulation parameters, in this order
+SIMCONFIG_FIELDS = ("technique", "mechanism", "Estart", "Eswitch", "scanrate", "Eform", "n", "ko", "alpha", "D",
+                    "D2", "area", "temp", "conc_bulk", "kcf", "kcr", "EstartAmp", "t1", "Epulse", "tend", "Cdl",
+                    "shift", "ru")
 
-        # TODO; multipulse amperometry
-        pulses = "single"
-        numpulses = 1
+# solver: time-stepping engine, either the explicit finite-difference scheme
+# or an implicit theta-scheme (theta = 1 backward Euler, 0.5 Crank-Nicolson)
+SOLVERS = {"explicit": 0.0, "implicit": 1.0, "crank-nicolson": 0.5}
+# RANNACHER_STEPS: time steps the theta < 1 solvers take as two backward
+# Euler half steps, from the start and after every potential jump
+RANNACHER_STEPS = 2
 
-        if mechanism == "CE":
-            if kcr != 0:
-                cchem_bulk = conc_bulk / (1 + kcf / kcr)
-            else:
-                cchem_bulk = 0
-            cox_bulk = conc_bulk - cchem_bulk
-            cred_bulk = 0
+
+def expm(a):
+    # matrix exponential by scaling and squaring of a Taylor series, enough
+    # for the small rate matrices used to propagate the homogeneous reactions
+    norm = np.abs(a).sum(axis=-1).max()
+    squarings = max(0, int(mt.ceil(mt.log2(norm))) + 1) if norm > 0 else 0
+    a = a / 2 ** squarings
+    term = np.eye(a.shape[-1])
+    result = term.copy()
+    for k in range(1, 13):
+        term = term @ a / k
+        result = result + term
+    for k in range(squarings):
+        result = result @ result
+    return result
+
+
+class Tridiagonal():
+    """Tridiagonal system factorised once and solved by cyclic reduction.
+
+    Each level of the reduction eliminates the odd rows from the even ones
+    with whole-array operations, so a solve takes 2 log2(nodes) vectorised
+    steps instead of a Python loop over the nodes.
+    """
+
+    # systems whose dense inverse has at most this many entries (size**2
+    # per coefficient set) keep it, so each solve is a single product; the
+    # product grows as size**2 while a reduction costs a roughly fixed
+    # ~0.3 ms, and they cross near 400 nodes for 5 species, 600 for 3 and
+    # 800 for one
+    DENSE_LIMIT = 640000
+
+    def __init__(self, lower, diag, upper):
+        # lower[i] multiplies x[i - 1] and upper[i] multiplies x[i + 1]; the
+        # nodes run along the first axis and the coefficients may carry
+        # further (batch, species) axes that broadcast against the right-hand
+        # sides; inside, the nodes are moved to the last axis
+        a, b, c = (np.moveaxis(np.asarray(v, dtype=float), 0, -1) for v in (lower, diag, upper))
+        a, b, c = (v.copy() for v in np.broadcast_arrays(a, b, c))
+        a[..., 0] = 0
+        c[..., -1] = 0
+        size = b.shape[-1]
+
+        # levels: lower, 1/diag and upper of the odd rows, for the back
+        # substitution, and the multipliers that add the odd rows above and
+        # below to each even row
+        self.levels = []
+        while b.shape[-1] > 1:
+            evens, odds = b[..., 0::2].shape[-1], b[..., 1::2].shape[-1]
+            odd = 1 / b[..., 1::2]
+            above = np.zeros(b[..., 0::2].shape)
+            below = np.zeros(b[..., 0::2].shape)
+            above[..., 1:] = -a[..., 2::2] * odd[..., :evens - 1]
+            below[..., :odds] = -c[..., 0::2][..., :odds] * odd
+            self.levels.append((a[..., 1::2], odd, c[..., 1::2], above, below))
+            reduced = b[..., 0::2].copy()
+            reduced[..., 1:] += above[..., 1:] * c[..., 1::2][..., :evens - 1]
+            reduced[..., :odds] += below[..., :odds] * a[..., 1::2]
+            a_next = np.zeros(reduced.shape)
+            c_next = np.zeros(reduced.shape)
+            a_next[..., 1:] = above[..., 1:] * a[..., 1::2][..., :evens - 1]
+            c_next[..., :odds] = below[..., :odds] * c[..., 1::2]
+            a, b, c = a_next, reduced, c_next
+        self.last = 1 / b
+        self.tail = b.shape[:-1]
+
+        # inverse: (tail..., size, size) for every trailing coefficient set
+        self.inverse = None
+        if size ** 2 * np.prod(self.tail, dtype=int) <= self.DENSE_LIMIT:
+            identity = np.eye(size).reshape((size, size) + (1,) * len(self.tail))
+            self.inverse = np.moveaxis(self.reduce(identity), (0, 1), (-2, -1))
+
+    def reduce(self, rhs):
+        # cyclic reduction; rhs has the nodes along its first axis and any
+        # number of right-hand sides after it
+        d = np.moveaxis(np.asarray(rhs, dtype=float), 0, -1)
+        shape = np.broadcast_shapes(d.shape, self.last.shape[:-1] + (d.shape[-1],))
+        stack = []
+        for a, odd, c, above, below in self.levels:
+            evens, odds = above.shape[-1], odd.shape[-1]
+            reduced = np.broadcast_to(d[..., 0::2], shape[:-1] + (evens,)).copy()
+            reduced[..., 1:] += above[..., 1:] * d[..., 1::2][..., :evens - 1]
+            reduced[..., :odds] += below[..., :odds] * d[..., 1::2]
+            stack.append(d[..., 1::2])
+            d = reduced
+        x = d * self.last
+        for (a, odd, c, above, below), d in zip(reversed(self.levels), reversed(stack)):
+            evens, odds = above.shape[-1], odd.shape[-1]
+            full = np.empty(shape[:-1] + (evens + odds,))
+            full[..., 0::2] = x
+            full[..., 1::2] = d - a * x[..., :odds]
+            full[..., 1:evens * 2 - 1:2] -= c[..., :evens - 1] * x[..., 1:]
+            full[..., 1::2] *= odd
+            x = full
+        return np.moveaxis(x, -1, 0)
+
+    def solve(self, rhs):
+        if self.inverse is None:
+            return self.reduce(rhs)
+        if self.inverse.ndim == 2:
+            return np.tensordot(self.inverse, rhs, axes=1)
+        x = self.inverse @ np.moveaxis(rhs, 0, -1)[..., None]
+        return np.moveaxis(x[..., 0], -1, 0)
+
+
+def spatial_grid(xtot, xunits, grid="uniform", gamma=1.1):
+    # distance: xunits + 1 nodes from the electrode surface out to xtot,
+    # either evenly spaced or with spacings growing by a factor gamma from
+    # one node to the next, so nodes are packed close to the surface; for an
+    # array of xtot, one row of nodes per value
+    if grid == "uniform":
+        return np.linspace(0, xtot, xunits + 1, axis=-1)
+    elif grid == "expanding":
+        h0 = np.asarray(xtot) * (gamma - 1) / (gamma ** xunits - 1)
+        return np.multiply.outer(h0, (gamma ** np.arange(xunits + 1) - 1) / (gamma - 1))
+    raise ValueError("Unknown grid: %s" % grid)
+
+
+def grid_units(xunits, cycles=1, grid="uniform", gamma=1.1):
+    # distance units for a program of cycles periods: the grid reaches
+    # sqrt(cycles) times further out than for one period, so the spacing at
+    # the electrode is kept at its one period value (uniform: sqrt(cycles)
+    # times more nodes; expanding: the same first spacing, and the outer
+    # spacings keep growing)
+    if cycles <= 1:
+        return xunits
+    if grid == "expanding":
+        return mt.ceil(mt.log(1 + mt.sqrt(cycles) * (gamma ** xunits - 1)) / mt.log(gamma) - 1e-9)
+    return mt.ceil(xunits * mt.sqrt(cycles) - 1e-9)
+
+
+def second_difference(distance):
+    # weights of c[j-1] and c[j+1] in the three-point second derivative at
+    # the interior nodes of a (possibly non-uniform) grid; the weight of
+    # c[j] is minus their sum
+    h = np.diff(distance)
+    left = 2 / (h[..., :-1] * (h[..., :-1] + h[..., 1:]))
+    right = 2 / (h[..., 1:] * (h[..., :-1] + h[..., 1:]))
+    return left, right
+
+
+def surface_flux(mech, u0, w0, kf, kb):
+    # fluxes of every electron transfer when the surface concentrations are
+    # u0 + w0 * (nu @ flux); the Butler-Volmer conditions are then a small
+    # linear system, a scalar division for a single electron transfer
+    ox, red = mech.oxidised, mech.reduced
+    if len(ox) == 1:
+        # one transfer: slices instead of index arrays, as this runs every step
+        o, r = slice(ox[0], ox[0] + 1), slice(red[0], red[0] + 1)
+        return (kb * u0[..., r] - kf * u0[..., o]) / (1 + kf * w0[..., o] + kb * w0[..., r])
+    rhs = -(kf * u0[..., ox] - kb * u0[..., red])
+    coupling = np.eye(len(ox)) + (kf * w0[..., ox])[..., None] * mech.nu[ox] - \
+        (kb * w0[..., red])[..., None] * mech.nu[red]
+    return np.linalg.solve(coupling, rhs[..., None])[..., 0]
+
+
+class OhmicCoupling():
+    """Surface boundary conditions solved together with the ohmic drop.
+
+    The interfacial potential E of each time step satisfies
+    E + ru * (iF(E) + iC(E)) = Eapp, where iF is the faradaic current of
+    the Butler-Volmer fluxes at E and iC = area * Cdl * (E - Eprev) / deltat
+    the double layer charging current. Newton iterations take the
+    derivative from a complex step, so they work for any mechanism and
+    batch shape. After each step, E and charging hold the interfacial
+    potential and the charging current.
+    """
+
+    def __init__(self, mech, temp, area, Cdl, ru, deltat, E, tolerance=1e-9, maxiter=20):
+        self.mech = mech
+        self.temp = temp
+        self.faraday = F * area * mech.n
+        self.capacitance = area * Cdl * 1e-6
+        self.ru = ru
+        self.deltat = deltat
+        self.E = np.asarray(E, dtype=float)
+        self.charging = np.zeros_like(self.E)
+        self.tolerance = tolerance
+        self.maxiter = maxiter
+
+    def residual(self, E, Eapp, u0, w0):
+        kf, kb = self.mech.rate_constants(E, self.temp)
+        jox = surface_flux(self.mech, u0, w0, kf, kb)
+        charging = self.capacitance * (E - self.E) / self.deltat
+        return E - Eapp + self.ru * (jox @ self.faraday + charging), jox, charging
+
+    def boundary(self, Eapp):
+        # boundary function for the steppers at applied potential Eapp
+        def solve(u0, w0):
+            E = self.E
+            h = 1e-20
+            for iteration in range(self.maxiter):
+                g = self.residual(E + 1j * h, Eapp, u0, w0)[0]
+                dE = np.clip(-g.real / (g.imag / h), -0.1, 0.1)
+                E = E + dE
+                if np.abs(dE).max() < self.tolerance:
+                    break
+            g, jox, self.charging = self.residual(E, Eapp, u0, w0)
+            self.E = E
+            return jox
+        return solve
+
+
+# The steppers advance concentration rows shaped (species, distance) for a
+# compiled mechanism. The mechanism numbers, deltat and distance may carry
+# leading batch axes, and then the rows are shaped (batch, species,
+# distance) and the rate constants and fluxes (batch, transfers).
+
+class ExplicitStepper():
+    """Explicit finite differences; stable while alambda <= 0.5."""
+
+    def __init__(self, mech, deltat, distance):
+        self.mech = mech
+        deltat = np.asarray(deltat, dtype=float)
+        deltax = distance[..., 1] - distance[..., 0]
+        self.w0 = deltax[..., None] / mech.D
+        left, right = second_difference(distance)
+        scale = (mech.D * deltat[..., None])[..., None]
+        self.left = scale * left[..., None, :]
+        self.right = scale * right[..., None, :]
+        self.centre = 1 - self.left - self.right
+        self.alambda = (mech.D * deltat[..., None] / deltax[..., None] ** 2).max(axis=-1)
+        self.rates = mech.rates * deltat[..., None, None]
+        self.deltat = deltat[..., None, None]
+        # first: whether there are first-order reactions (not for E)
+        self.first = bool(np.any(mech.rates))
+
+    def step(self, cprev, c, kf, kb, boundary=None):
+        # interior nodes 1..xunits-1; the last node stays at bulk; boundary,
+        # if given, solves the surface fluxes instead of surface_flux
+        c[..., 1:-1] = self.left * cprev[..., :-2] + self.centre * cprev[..., 1:-1] + \
+            self.right * cprev[..., 2:]
+        if self.first:
+            c[..., 1:-1] += self.rates @ cprev[..., 1:-1]
+        if self.mech.second_pairs:
+            c[..., 1:-1] += self.deltat * self.mech.reaction_rates(cprev[..., 1:-1])
+
+        if boundary is None:
+            jox = surface_flux(self.mech, c[..., 1], self.w0, kf, kb)
         else:
-            cox_bulk = conc_bulk
-            cred_bulk = 0
-            cchem_bulk = 0
+            jox = boundary(c[..., 1], self.w0)
+        c[..., 0] = c[..., 1] + self.w0 * (jox @ self.mech.nu.T)
+        return jox
+
 
-        if (Estart > Eswitch):
-            sweepsign = -1
+class ImplicitStepper():
+    """Implicit theta-scheme with the Butler-Volmer fluxes solved implicitly.
+
+    The homogeneous reactions are advanced over the time step first (exactly
+    for first-order ones) and the diffusion step is a tridiagonal solve. The
+    concentrations depend linearly on the surface fluxes, c = u + w * (nu @
+    jox), where w is the response to a unit flux, so the boundary conditions
+    reduce to a small linear system.
+    """
+
+    def __init__(self, mech, deltat, distance, theta=1.0):
+        self.mech = mech
+        self.theta = theta
+        self.distance = distance
+        self.backward = {}
+        deltat = np.asarray(deltat, dtype=float)
+        deltax = distance[..., 1] - distance[..., 0]
+        self.alambda = (mech.D * deltat[..., None] / deltax[..., None] ** 2).max(axis=-1)
+        self.bulk = mech.bulk
+        self.propagator = expm(mech.rates * deltat[..., None, None])
+        self.first = bool(np.any(mech.rates))
+        self.deltat = deltat[..., None, None]
+
+        # second-order reactions: explicit substeps short enough for the
+        # fastest pseudo-first-order rate at bulk concentrations
+        self.substeps = 1
+        if mech.second_pairs:
+            fastest = np.max(np.abs(mech.second_rates)) * np.max(mech.bulk) * np.max(deltat)
+            self.substeps = max(1, int(mt.ceil(4 * fastest)))
+
+        left, right = second_difference(distance)
+        scale = (mech.D * deltat[..., None])[..., None]
+        self.left = scale * left[..., None, :]
+        self.right = scale * right[..., None, :]
+
+        # unknowns are nodes 0..xunits-1; row 0 is the flux boundary
+        # (c0 - c1 = jox * deltax / D) and the last node is held at bulk;
+        # the coefficients carry the nodes first and the species last
+        nodes = distance.shape[-1] - 1
+        shape = (nodes,) + np.shape(scale)[:-1]
+        lower = np.zeros(shape)
+        diag = np.ones(shape)
+        upper = np.zeros(shape)
+        lower[1:] = -theta * np.moveaxis(self.left, -1, 0)
+        upper[1:] = -theta * np.moveaxis(self.right, -1, 0)
+        diag[1:] = 1 - lower[1:] - upper[1:]
+        upper[0] = -1
+        self.matrix = Tridiagonal(lower, diag, upper)
+
+        unitflux = np.zeros(shape)
+        unitflux[0] = deltax[..., None] / mech.D
+        self.w = np.moveaxis(self.matrix.solve(unitflux), 0, -1)
+
+    def step(self, cprev, c, kf, kb, boundary=None):
+        old = self.propagator @ cprev if self.first else cprev
+        for i in range(self.substeps if self.mech.second_pairs else 0):
+            old = old + self.deltat / self.substeps * self.mech.reaction_rates(old)
+        nodes = self.w.shape[-1]
+        explicit = 1 - self.theta
+
+        interior = old[..., 1:nodes] + explicit * (
+                self.left * old[..., :nodes - 1] - (self.left + self.right) * old[..., 1:nodes] +
+                self.right * old[..., 2:nodes + 1])
+        rhs = np.empty((nodes,) + interior.shape[:-1])
+        rhs[0] = 0
+        rhs[1:] = np.moveaxis(interior, -1, 0)
+        rhs[-1] += self.theta * self.right[..., -1] * self.bulk
+        u = np.moveaxis(self.matrix.solve(rhs), 0, -1)
+
+        if boundary is None:
+            jox = surface_flux(self.mech, u[..., 0], self.w[..., 0], kf, kb)
         else:
-            sweepsign = +1
-
-
-        # ttot: time to complete one full sweep from e.start to e.start
-        # tunits: number of discrete times used to calculate results
-        # deltat: increment in time
-        # time: vector of discrete times for diffusion grid
-        if technique == "Voltammetry":
-            ttot = 2 * abs(Estart - Eswitch) / scanrate
-            deltat = ttot / tunits
-            self.time = np.arange(0, ttot + deltat, deltat)
-        elif technique == "Chronoamperometry":
-            ttot = tend
-            deltat = ttot / tunits
-            self.time = np.arange(0, ttot + deltat, deltat)
+            jox = boundary(u[..., 0], self.w[..., 0])
+        c[..., :nodes] = u + (jox @ self.mech.nu.T)[..., None] * self.w
+        c[..., nodes] = self.bulk
+        return jox
+
+    def damped_step(self, cprev, c, kf, kb, boundary=None, substeps=2):
+        # the step as substeps backward Euler steps, for the steps after a
+        # potential jump (see damped_steps); boundary is called once per
+        # substep
+        if substeps not in self.backward:
+            self.backward[substeps] = ImplicitStepper(self.mech, self.deltat[..., 0, 0] / substeps, self.distance)
+        backward = self.backward[substeps]
+        for k in range(substeps - 1):
+            middle = np.empty_like(cprev)
+            backward.step(cprev, middle, kf, kb, boundary)
+            cprev = middle
+        return backward.step(cprev, c, kf, kb, boundary)
+
+
+def make_stepper(solver, mech, deltat, distance):
+    if solver == "explicit":
+        return ExplicitStepper(mech, deltat, distance)
+    elif solver in SOLVERS:
+        return ImplicitStepper(mech, deltat, distance, theta=SOLVERS[solver])
+    raise ValueError("Unknown solver: %s" % solver)
+
+
+def damped_steps(stepper, time, jumps):
+    # time steps to take with backward Euler instead of the theta < 1 scheme
+    # of stepper (Rannacher start-up): the first RANNACHER_STEPS steps from
+    # t = 0 and from each potential jump, which would otherwise start
+    # oscillations that Crank-Nicolson does not damp
+    if not isinstance(stepper, ImplicitStepper) or stepper.theta == 1.0:
+        return set()
+    steps = set()
+    for t in [0.0] + list(jumps):
+        first = max(1, int(np.searchsorted(time, t)))
+        steps.update(range(first, first + RANNACHER_STEPS))
+    return steps
+
+
+class AdaptiveMarch():
+    """Advance the concentrations to ttot with step doubling error control.
+
+    Each step is taken once with dt and twice with dt/2; the difference in
+    concentrations and flux is the local error estimate. Step sizes are
+    dtfirst * 2**level, so each level is factorised only once. Steps are
+    cut short to land on the times in stops, and after the potential jumps
+    the step size restarts from dtfirst.
+    Iterating yields (time, concentrations, flux) after each accepted step.
+    """
+
+    def __init__(self, make_stepper, c, rate_constants, ttot, stops=(), jumps=(), tolerance=1e-3, order=2):
+        self.make_stepper = make_stepper
+        self.c = np.array(c, dtype=float)
+        self.rate_constants = rate_constants
+        self.ttot = ttot
+        self.jumps = set(jumps)
+        self.stops = sorted(set(s for s in list(stops) + list(jumps) if 0 < s < ttot)) + [ttot]
+        self.tolerance = tolerance
+        self.order = order
+        self.dtfirst = ttot * 1e-6
+        self.minlevel = -20
+        self.steppers = {}
+        self.accepted = 0
+        self.rejected = 0
+
+    def stepper(self, level):
+        if level not in self.steppers:
+            self.steppers[level] = self.make_stepper(self.dtfirst * 2.0 ** level)
+        return self.steppers[level]
+
+    def __iter__(self):
+        c = self.c
+        full = np.empty_like(c)
+        half = np.empty_like(c)
+        two = np.empty_like(c)
+        scale = np.abs(c).max() or 1.0
+        fluxscale = 0.0
+        level = 0
+        t = 0.0
+
+        while t < self.ttot:
+            stop = next(s for s in self.stops if s > t)
+            dt = self.dtfirst * 2.0 ** level
+            partial = t + dt >= stop
+            if partial:
+                dt = stop - t
+                big, small = self.make_stepper(dt), self.make_stepper(dt / 2)
+            else:
+                big, small = self.stepper(level), self.stepper(level - 1)
+
+            kf, kb = self.rate_constants(t + dt)
+            kfh, kbh = self.rate_constants(t + dt / 2)
+            jbig = big.step(c, full, kf, kb)
+            small.step(c, half, kfh, kbh)
+            jox = small.step(half, two, kf, kb)
+
+            fluxscale = max(fluxscale, np.abs(jox).max())
+            err = np.abs(two - full).max() / scale
+            if fluxscale > 0:
+                err = max(err, np.abs(jox - jbig).max() / fluxscale)
+            err /= self.tolerance
+
+            if err > 1 and level > self.minlevel:
+                self.rejected += 1
+                if partial:
+                    level = min(level, mt.floor(mt.log2(dt / self.dtfirst)))
+                level = max(self.minlevel, level - max(1, mt.ceil(mt.log2(err) / self.order)))
+                continue
+
+            t = stop if partial else t + dt
+            c, two = two, c
+            self.accepted += 1
+            yield t, c, jox
+
+            if t in self.jumps:
+                level = 0
+            elif err < 0.5 ** (self.order + 1) and not partial:
+                level += 1
+
+
+class PeriodicSteadyState():
+    """Detect and skip ahead to the periodic steady state of a cyclic program.
+
+    At the end of every cycle the fluxes of the cycle are compared with the
+    ones a cycle before. Once the largest change, relative to the largest
+    flux, is below tolerance the remaining cycles repeat the last one and are
+    copied instead of simulated. While the change shrinks by a steady factor
+    r < 1 per cycle (geometric convergence, checked over three cycles), the
+    concentration profile is extrapolated to the cycle where the change
+    should fall below tolerance, and the fluxes (and concentrations, if the
+    full history is stored) of the skipped cycles are extrapolated the same
+    way. The cycle after a skip is simulated and its change of the fluxes
+    checked against the extrapolated one; if they disagree by more than
+    tolerance, the run goes back to the cycle before the skip and continues
+    without extrapolation. Diffusion-limited responses converge slower than
+    geometrically and are only simulated until the tolerance is met.
+    """
+
+    def __init__(self, period, tolerance, extrapolate=True):
+        self.period = period
+        self.tolerance = tolerance
+        self.extrapolate = extrapolate
+        self.previous = None
+        self.changes = []
+        self.converged = None
+        self.skipped = 0
+        # pending: (step, concentrations, skipped cycles, predicted change of
+        # the fluxes) of the last skip, until the cycle after it is checked;
+        # rejected: skips undone because the check failed
+        self.pending = None
+        self.rejected = 0
+
+    def cycle_end(self, i, rows, jox, tunits):
+        # called after step i closes a cycle; fills any skipped steps in rows
+        # and jox and returns the step the time loop continues from
+        period = self.period
+        numrows = len(rows)
+        full = numrows == len(jox)
+        c = rows[i % numrows]
+        delta = c - self.previous if self.previous is not None else None
+        self.previous = c.copy()
+        if i < 2 * period:
+            return i
+        last = slice(i - period + 1, i + 1)
+        before = slice(i - 2 * period + 1, i - period + 1)
+        difference = jox[last] - jox[before]
+        change = np.abs(difference).max()
+        scale = np.abs(jox[last]).max() or 1.0
+        remaining = (tunits - i) // period
+
+        if self.pending is not None:
+            start, saved, cycles, predicted = self.pending
+            self.pending = None
+            if np.abs(difference - predicted).max() > self.tolerance * scale:
+                # the extrapolation was wrong: back to the end of the cycle
+                # before the skip, which is simulated from there on
+                rows[start % numrows] = saved
+                self.previous = saved.copy()
+                self.skipped -= cycles
+                self.rejected += 1
+                self.extrapolate = False
+                self.changes = []
+                return start
+
+        if change < self.tolerance * scale:
+            self.converged = i
+            for start in range(i + 1, tunits + 1, period):
+                size = min(period, tunits + 1 - start)
+                jox[start:start + size] = jox[last][:size]
+                if full:
+                    rows[start:start + size] = rows[last][:size]
+            self.skipped += remaining
+            return tunits
+
+        self.changes.append(change)
+        if not self.extrapolate or delta is None or len(self.changes) < 3 or remaining < 2:
+            return i
+        ratio = self.changes[-1] / self.changes[-2]
+        previous_ratio = self.changes[-2] / self.changes[-3]
+        if ratio >= 0.95 or abs(ratio - previous_ratio) > 0.02 * (1 - ratio):
+            return i
+
+        # cycles: how many cycles to skip, leaving the last one to simulate;
+        # growth: sum of ratio**k for k = 1..j, the extrapolated change after
+        # j cycles in units of the last one
+        cycles = min(mt.ceil(mt.log(self.tolerance * scale / change) / mt.log(ratio)), remaining - 1)
+        if cycles < 1:
+            return i
+        for j in range(1, cycles + 1):
+            growth = ratio * (1 - ratio ** j) / (1 - ratio)
+            start = i + (j - 1) * period + 1
+            jox[start:start + period] = jox[last] + growth * (jox[last] - jox[before])
+            if full:
+                rows[start:start + period] = rows[last] + growth * (rows[last] - rows[before])
+        growth = ratio * (1 - ratio ** cycles) / (1 - ratio)
+        target = c + growth * delta
+        self.pending = (i, c.copy(), cycles, ratio ** (cycles + 1) * difference)
+        i += cycles * period
+        rows[i % numrows] = target
+        self.previous = target
+        self.changes = []
+        self.skipped += cycles
+        return i
+
+
+def default_waveform(simconfig, cycles=1):
+    # potential program of a simconfig: a sweep Estart -> Eswitch -> Estart
+    # (repeated cycles times) for voltammetry and a step from EstartAmp to
+    # Epulse at t1 for chronoamperometry
+    values = dict(zip(SIMCONFIG_FIELDS, simconfig))
+    if values["technique"] == "Voltammetry":
+        return Waveform.cv(values["Estart"], values["Eswitch"], values["scanrate"], cycles)
+    elif values["technique"] == "Chronoamperometry":
+        return Waveform.steps([values["EstartAmp"], values["Epulse"]],
+                              [values["t1"], values["tend"] - values["t1"]])
+
+
+def default_programs(values, tunits=1000):
+    # default_waveform of every config of a batch, from the simconfig fields
+    # as arrays with one entry per config (technique shared): the times,
+    # potentials and sweep rates (dE/dt), one row per config, and the jump
+    # times of each config
+    if values["technique"] == "Voltammetry":
+        Estart, Eswitch = values["Estart"][:, None], values["Eswitch"][:, None]
+        half = abs(Eswitch - Estart) / values["scanrate"][:, None]
+        rate = np.sign(Eswitch - Estart) * values["scanrate"][:, None]
+        time = np.linspace(0, 2 * half[:, 0], tunits + 1, axis=-1)
+        # forward ramp on [0, half), then back to Estart and held there
+        forward = time < half
+        potential = np.where(forward, Estart + rate * time, Eswitch - rate * np.minimum(time - half, half))
+        slope = np.where(forward, rate, np.where(time < 2 * half, -rate, 0))
+        jumps = [[] for row in time]
+    elif values["technique"] == "Chronoamperometry":
+        time = np.linspace(0, values["tend"], tunits + 1, axis=-1)
+        potential = np.where(time < values["t1"][:, None], values["EstartAmp"][:, None], values["Epulse"][:, None])
+        slope = np.zeros(time.shape)
+        jumps = [[t1] if t1 > 0 and Ea != Ep else [] for t1, Ea, Ep in
+                 zip(values["t1"], values["EstartAmp"], values["Epulse"])]
+    else:
+        raise ValueError("Unknown technique: %s" % values["technique"])
+    return time, potential, slope, jumps
+
+
+def charging_current(waveform, time, area, Cdl):
+    # double layer charging current (A) from the sweep rate; Cdl in uF/cm2
+    #TODO: add capacitive current for potential steps
+    return area * Cdl * 1e-6 * waveform.slope(time)
+
+
+class SimulationSetup():
+    """Everything a run derives from one simconfig before time stepping."""
+
+    def __init__(self, simconfig, tunits=1000, xunits=100, grid="uniform", gamma=1.1, mechanism_params=None,
+                 waveform=None, cycles=1, profiler=None):
+        technique, mechanism, Estart, Eswitch, scanrate, Eform, n, ko, alpha, D, D2, area, temp, conc_bulk, \
+            kcf, kcr, EstartAmp, t1, Epulse, tend, Cdl, shift, ru = simconfig
+
+        self.technique = technique
+        self.area = area
+        self.temp = temp
+        self.Cdl = Cdl
+        self.shift = shift
+        self.ru = ru
+
+        # mech: compiled reaction mechanism (species, electron transfers and
+        # homogeneous reactions); mechanism_params sets the second-step
+        # parameters (n2, Eform2, ko2, alpha2, kcf2, kcr2) of ECE-like schemes
+        with phase(profiler, "mechanism"):
+            self.mech = build_mechanism(dict(zip(SIMCONFIG_FIELDS, simconfig)), mechanism_params)
+
+        with phase(profiler, "waveform"):
+            # waveform: potential program of the simconfig, unless another
+            # program (e.g. a multi-pulse Waveform.steps) is given
+            if waveform is None:
+                waveform = default_waveform(simconfig, cycles)
+            self.waveform = waveform
+
+            # ttot: time to complete the whole potential program
+            # tunits: number of discrete times used to calculate results, per
+            # cycle of the sweep; period: time steps in one cycle
+            # deltat: increment in time
+            # time: vector of discrete times for diffusion grid
+            self.ttot = waveform.duration
+            self.period = tunits
+            self.tunits = tunits * cycles
+            self.deltat = self.ttot / self.tunits
+            self.time = np.linspace(0, self.ttot, self.tunits + 1)
+
+            # potential: vector of discrete applied potentials
+            # capcurrent: double layer charging current from the sweep rate
+            self.potential = waveform.sample(self.time)
+            self.capcurrent = charging_current(waveform, self.time, area, Cdl)
+
+            # kf: rate constant for forward (ox -> red) reaction at each potential
+            # kb: rate constant for backward (red -> ox) reaction at each potential
+            # (rows = time; cols = electron transfers)
+            self.kf, self.kb = self.rate_constants(self.potential)
 
         # xtot: max distance from electrode chosen to exceed difusion limit
-        # xunits: number of discrete distances used to calculate results
-        # deltax: increment in distance
-        # distance: vector of discrete distances for diffusion grid
-        xtot = 6 * mt.sqrt(D * ttot)
-        # xunits = 50
-        deltax = xtot / xunits
-        self.distance = np.arange(0, xtot, deltax)
-
-        # potential: vector of discrete applied potentials; initial vector is
-        # filled using Estart and then potentials are calculated at other
-        # times using two loops (Estart -> Eswitch and Eswitch -> Estart)
-        if technique == "Voltammetry":
-            self.potential = [Estart] * (tunits + 1)
-            self.capcurrent = [0.0] * (tunits + 1)
-            for i in range(int(tunits / 2)):
-                # print(i, potential[i], potential[i] - scanrate*deltat)
-                self.potential[i + 1] = self.potential[i] + scanrate * deltat * sweepsign
-                self.capcurrent[i] = area * Cdl * 1e-6 * scanrate * sweepsign
-            for i in range(int((1 + tunits) / 2), tunits):
-                # print(i, potential[i], potential[i] + scanrate*deltat)
-                self.potential[i + 1] = self.potential[i] - scanrate * deltat * sweepsign
-                self.capcurrent[i] = - area * Cdl * 1e-6 * scanrate * sweepsign
-        else:
-            #TODO: add capacitive current for chronoamperometry
-            pot1 = [Estart] * round(tunits*t1/ttot)
-            pot2 = [Epulse] * (tunits-len(pot1)+1)
-            self.potential = pot1 + pot2
-
-        # kf: rate constant for forward (ox -> red) reaction at each potential
-        # kb: rate constant for backward (red -> ox) reaction at each potential
-        # lambda: simulation parameter (just a gathering of constants)
-        kf = ko * np.exp(-alpha * n * F * (np.array(self.potential) - Eform) / (R * temp))
-        kb = ko * np.exp((1 - alpha) * n * F * (np.array(self.potential) - Eform) / (R * temp))
-
-
-        # initialize diffusion grid (rows = time; cols = distance)
-        #  using bulk concentrations for ox and for red
-        self.cox = [[cox_bulk for x in range(xunits + 1)] for x in range(tunits + 1)]
-        self.cred = [[cred_bulk for x in range(xunits + 1)] for x in range(tunits + 1)]
-        self.cchem = [[cchem_bulk for x in range(xunits + 1)] for x in range(tunits + 1)]
-
-        # create vectors for fluxes and current, which are calculated
-        # later in for loops; the initial values here not important as actual
-        # values are calculated later
-        jox = [0.0] * (tunits + 1)
-        jred = [0.0] * (tunits + 1)
-        self.current_total = [0.0] * (tunits + 1)
-
-        # calculate diffusion grid over time and over distance; for each time
-        # the diffusion grid first is calculated at all distances except for
-        # that at the electrode surface and then calculated at the electrode
-        # surface; finally, the current is calculate for each time
-
-        alambda = D * deltat / (deltax) ** 2
-        #TODO: option for both diffusion coefficients
-        #alambda2 = D2 * deltat / (deltax) ** 2
+        # xunits: number of discrete distances used to calculate results, per
+        # cycle (more for several cycles, see grid_units)
+        # distance: vector of discrete distances for diffusion grid, uniform
+        # or expanding geometrically away from the electrode
+        with phase(profiler, "grid"):
+            xtot = 6 * mt.sqrt(self.mech.D.max() * self.ttot)
+            self.xunits = grid_units(xunits, cycles, grid, gamma)
+            self.distance = spatial_grid(xtot, self.xunits, grid, gamma)
 
-        for i in range(1, tunits + 1):
-            for j in range(1, xunits):
-                self.cox[i][j] = self.cox[i - 1][j] + alambda * (
-                        self.cox[i - 1][j - 1] - 2 * self.cox[i - 1][j] + self.cox[i - 1][j + 1])
-
-                if mechanism == "E":
-                    self.cred[i][j] = self.cred[i - 1][j] + alambda * (
-                            self.cred[i - 1][j - 1] - 2 * self.cred[i - 1][j] + self.cred[i - 1][j + 1])
-                elif mechanism == "EC" or mechanism == "ECat":
-                    self.cred[i][j] = self.cred[i - 1][j] + alambda * (
-                            self.cred[i - 1][j - 1] - 2 * self.cred[i - 1][j] + self.cred[i - 1][j + 1]) - (
-                                              kcf * deltat * self.cred[i - 1][j]) + (kcr * deltat * self.cchem[i - 1][j])
-                    self.cchem[i][j] = self.cchem[i - 1][j] + alambda * (
-                            self.cchem[i - 1][j - 1] - 2 * self.cchem[i - 1][j] + self.cchem[i - 1][j + 1]) + (
-                                               kcf * deltat * self.cred[i - 1][j]) - (kcr * deltat * self.cchem[i - 1][j])
-                    if mechanism == "ECat":
-                        self.cox[i][j] = self.cox[i - 1][j] + alambda * (
-                                self.cox[i - 1][j - 1] - 2 * self.cox[i - 1][j] + self.cox[i - 1][j + 1]) + kcf * deltat * \
-                                         self.cred[i - 1][j] - kcr * deltat * self.cox[i - 1][j]
-                elif mechanism == "CE":
-                    self.cox[i][j] = self.cox[i - 1][j] + alambda * (
-                            self.cox[i - 1][j - 1] - 2 * self.cox[i - 1][j] + self.cox[i - 1][j + 1]) + kcf * deltat * \
-                                     self.cchem[i - 1][j] - kcr * deltat * self.cox[i - 1][j]
-                    self.cred[i][j] = self.cred[i - 1][j] + alambda * (
-                            self.cred[i - 1][j - 1] - 2 * self.cred[i - 1][j] + self.cred[i - 1][j + 1])
-                    self.cchem[i][j] = self.cchem[i - 1][j] + alambda * (
-                            self.cchem[i - 1][j - 1] - 2 * self.cchem[i - 1][j] + self.cchem[i - 1][j + 1]) - (
-                                               kcf * deltat * self.cchem[i - 1][j]) + (kcr * deltat * self.cox[i - 1][j])
-
-                jox[i] = -(kf[i] * self.cox[i][1] - kb[i] * self.cred[i][1]) / (1 + (kf[i] * deltax) / D + (kb[i] * deltax) / D)
-
-                jred[i] = -jox[i]
-                self.cox[i][0] = self.cox[i][1] + jox[i] * deltax / D
-                self.cred[i][0] = self.cred[i][1] + jred[i] * deltax / D
-                self.cchem[i][0] = self.cchem[i][1]
-
-            self.current_total[i] = n * F * area * jox[i] + self.capcurrent[i]
-
-        self.current_total = np.array(self.current_total) + 1e-6*shift
+    def rate_constants(self, E):
+        # Butler-Volmer rate constants at potential(s) E
+        return self.mech.rate_constants(E, self.temp)
 
+    def potential_at(self, t):
+        # applied potential at any time t, for the adaptive time stepping; a
+        # step ending on a jump still sees the potential before the jump
+        return self.waveform.potential(t, side="left")
 
-        # Calculate iR drop and correct potentials
-        irdrop = ru * self.current_total
-        self.potential = self.potential + irdrop
+    def breakpoints(self):
+        # stops: times the adaptive time steps must land on; jumps: times
+        # where the potential is discontinuous
+        return self.waveform.breakpoints()
 
-        if technique == "Chronoamperometry":
-            #FIXME: something wrong with tend in CA
-            lists = [self.potential, self.current_total, self.time, self.cox, self.cred, self.cchem]
-            for lista in lists:
-                if type(lista) == np.ndarray:
-                    newlist = lista.tolist()
-                    newlist.pop(0)
-                    self.time = np.array(newlist)
-                else:
-                    lista.pop(0)
 
+class Simulation():
+    def __init__(self, simconfig, solver="explicit", tunits=1000, xunits=100, grid="uniform", gamma=1.1,
+                 storage="full", snapshot_every=None, snapshot_times=None, adaptive=False, tolerance=1e-3,
+                 mechanism_params=None, waveform=None, cycles=1, steady_state=None, extrapolate=True,
+                 ir_mode="post", profile=None, progress=None):
+        # profile: True or a profiling.Profiler (e.g. with a callback) to
+        # time the phases of the run; the profiler is kept in profiler and
+        # attached to the result of get_data
+        # progress: called as progress(step, steps) about every hundredth of
+        # the time steps and at the end; an exception raised from it stops
+        # the run (e.g. to cancel it)
+        profiler = Profiler() if profile is True else profile or None
+        self.profiler = profiler
 
-    def get_data(self):
-        # return calculated results as a list to input into plotting functions
+        # a config.SimConfig is checked before the run, including the
+        # stability of the explicit solver
+        if hasattr(simconfig, "validate"):
+            with phase(profiler, "validation"):
+                simconfig.validate(solver=solver, tunits=tunits, xunits=xunits, grid=grid, gamma=gamma,
+                                   cycles=cycles, waveform=waveform)
+        setup = SimulationSetup(simconfig, tunits, xunits, grid, gamma, mechanism_params, waveform, cycles, profiler)
+        tunits = setup.tunits
+        xunits = setup.xunits
+        technique = setup.technique
+        deltat = setup.deltat
+        mech = setup.mech
+        numspecies = len(mech.species)
+        kf, kb = setup.kf, setup.kb
+        self.time = setup.time
+        self.distance = setup.distance
+        self.potential = setup.potential
+        self.capcurrent = setup.capcurrent
+
+        # initialize diffusion grid (rows = time; then one row per species of
+        # the mechanism; cols = distance) using bulk concentrations for each species; the
+        # rolling storage keeps only the previous and the current rows plus
+        # the snapshots requested every snapshot_every steps or at
+        # snapshot_times
+        with phase(profiler, "grid"):
+            if storage == "full":
+                rows = np.empty((tunits + 1, numspecies, xunits + 1))
+                snapsteps = ()
+            elif storage == "rolling":
+                rows = np.empty((2, numspecies, xunits + 1))
+                snapsteps = set()
+                if snapshot_every:
+                    snapsteps.update(range(0, tunits + 1, snapshot_every))
+                if snapshot_times is not None:
+                    snapsteps.update(np.clip(np.rint(np.asarray(snapshot_times) / deltat), 0, tunits).astype(int))
+                # chronoamperometry drops the t = 0 row, as from the full history
+                if technique == "Chronoamperometry":
+                    snapsteps.discard(0)
+            else:
+                raise ValueError("Unknown storage: %s" % storage)
+            rows[:] = mech.bulk[:, None]
+            snapshots = [rows[0].copy()] if 0 in snapsteps else []
+            snapped = [0] if 0 in snapsteps else []
+
+            # create vectors for fluxes (one column per electron transfer) and
+            # current, which are calculated later in the time loop
+            jox = np.zeros((tunits + 1, len(mech.n)))
+
+            # calculate diffusion grid over time; each step advances the whole
+            # concentration row from the previous one, calculates the flux at the
+            # electrode surface and the concentrations there; finally, the current
+            # is calculated from the flux
+            stepper = make_stepper(solver, mech, deltat, self.distance)
+            self.alambda = stepper.alambda
+            damped = damped_steps(stepper, setup.time, setup.breakpoints()[1])
+
+        # steady_state: tolerance on the change of the surface fluxes from
+        # one cycle to the next, relative to the largest flux; once reached,
+        # the remaining cycles are not simulated (see PeriodicSteadyState)
+        numrows = len(rows)
+        periodic = None
+        if steady_state and cycles > 1:
+            if adaptive:
+                raise ValueError("Steady state detection needs uniform time steps")
+            periodic = PeriodicSteadyState(setup.period, steady_state, extrapolate)
+
+        # ir_mode: "post" adds ru * current to the potentials afterwards;
+        # "coupled" solves the interfacial potential of every step together
+        # with the ohmic drop and the double layer charging (OhmicCoupling),
+        # and the potentials stay the applied ones
+        ohmic = None
+        if ir_mode == "coupled":
+            if adaptive or periodic:
+                raise ValueError("The coupled iR drop needs uniform time steps without steady state skipping")
+            ohmic = OhmicCoupling(mech, setup.temp, setup.area, setup.Cdl, setup.ru, deltat, self.potential[0])
+            self.interfacial_potential = self.potential.copy()
+            self.capcurrent = np.zeros(tunits + 1)
+        elif ir_mode != "post":
+            raise ValueError("Unknown ir_mode: %s" % ir_mode)
+
+        # with a profiler, the surface fluxes are solved through a timed
+        # boundary function, so their share of the time stepping shows (not
+        # for adaptive steps, whose steppers are made by AdaptiveMarch)
+        flux = None
+        if profiler is not None:
+            flux = lambda u0, w0: surface_flux(mech, u0, w0, kf[i], kb[i])
+        every = max(1, tunits // 100)
+
+        with phase(profiler, "time stepping") as stepping:
+            if not adaptive:
+                i = 1
+                while i <= tunits:
+                    row = rows[i % numrows]
+                    boundary = ohmic.boundary(self.potential[i]) if ohmic else flux
+                    if profiler is not None:
+                        boundary = profiler.timed("boundary flux", boundary)
+                    if i in damped:
+                        # the coupled iR drop charges the double layer over
+                        # a whole time step: no substeps
+                        jox[i] = stepper.damped_step(rows[(i - 1) % numrows], row, kf[i], kb[i], boundary,
+                                                     1 if ohmic else 2)
+                    else:
+                        jox[i] = stepper.step(rows[(i - 1) % numrows], row, kf[i], kb[i], boundary)
+                    if ohmic:
+                        self.interfacial_potential[i] = ohmic.E
+                        self.capcurrent[i] = ohmic.charging
+                    if i in snapsteps:
+                        snapshots.append(row.copy())
+                        snapped.append(i)
+                    if periodic and i % setup.period == 0:
+                        i = periodic.cycle_end(i, rows, jox, tunits)
+                        # a rejected skip goes back: drop the snapshots after it
+                        while snapped and snapped[-1] > i:
+                            snapped.pop()
+                            snapshots.pop()
+                    if progress is not None and (i % every == 0 or i == tunits):
+                        progress(i, tunits)
+                    i += 1
+                stepping["steps"] = tunits - ((periodic.skipped - periodic.rejected) * setup.period
+                                              if periodic else 0)
+            else:
+                # adaptive time steps; fluxes and concentrations are then
+                # interpolated linearly onto the uniform time vector
+                if solver == "explicit":
+                    raise ValueError("Adaptive time stepping needs an implicit solver")
+                theta = SOLVERS[solver]
+                stops, jumps = setup.breakpoints()
+                march = AdaptiveMarch(lambda dt: ImplicitStepper(mech, dt, self.distance, theta),
+                                      rows[0], lambda t: setup.rate_constants(setup.potential_at(t)), setup.ttot,
+                                      stops, jumps, tolerance, order=2 if theta == 1.0 else 3)
+
+                i = 1
+                tprev, cprev, jprev = 0.0, rows[0].copy(), 0.0
+                for t, c, j in march:
+                    while i <= tunits and self.time[i] <= t * (1 + 1e-12):
+                        w = (self.time[i] - tprev) / (t - tprev)
+                        jox[i] = jprev + w * (j - jprev)
+                        if storage == "full":
+                            rows[i] = cprev + w * (c - cprev)
+                        elif i in snapsteps:
+                            snapshots.append(cprev + w * (c - cprev))
+                            snapped.append(i)
+                        i += 1
+                    tprev, cprev, jprev = t, c.copy(), j
+                    if progress is not None:
+                        progress(i - 1, tunits)
+                # steps: number of accepted and rejected adaptive time steps
+                self.steps = march.accepted
+                self.rejected_steps = march.rejected
+                stepping["steps"] = march.accepted
+
+        with phase(profiler, "post-processing"):
+            # conc: concentration history, or only the snapshots when rolling;
+            # snapshot_time: time of each stored row
+            if storage == "full":
+                self.conc = rows
+                self.snapshot_time = self.time
+            else:
+                self.conc = np.array(snapshots).reshape(-1, numspecies, xunits + 1)
+                self.snapshot_time = self.time[snapped]
+            self.species = mech.species
+            self.select_species()
+
+            # steady_step: time step where the periodic steady state was reached
+            # (None if it was not); skipped_cycles: cycles extrapolated or copied
+            # instead of simulated
+            self.steady_step = periodic.converged if periodic else None
+            self.skipped_cycles = periodic.skipped if periodic else 0
+
+            self.current_total = np.zeros(tunits + 1)
+            self.current_total[1:] = F * setup.area * jox[1:] @ mech.n + self.capcurrent[1:]
+            self.current_total = self.current_total + 1e-6*setup.shift
+
+            # Calculate iR drop and correct potentials
+            if ir_mode == "post":
+                irdrop = setup.ru * self.current_total
+                self.potential = self.potential + irdrop
+
+            if technique == "Chronoamperometry":
+                # drop the t = 0 point, where no potential step has happened yet
+                if ohmic:
+                    self.interfacial_potential = self.interfacial_potential[1:]
+                self.potential = self.potential[1:]
+                self.current_total = self.current_total[1:]
+                self.time = self.time[1:]
+                if storage == "full":
+                    self.conc = self.conc[1:]
+                    self.snapshot_time = self.time
+                    self.select_species()
+
+    def select_species(self):
+        # cox, cred, cchem: views of the ox, red and chem species in conc, or
+        # None when the mechanism has no such species
+        for name in ("ox", "red", "chem"):
+            view = self.conc[:, self.species.index(name)] if name in self.species else None
+            setattr(self, "c" + name, view)
+
+    def get_data(self, dtype=np.float64):
+        # return calculated results to input into plotting functions, as a
+        # SimulationResult that unpacks like the list
+        # [potential, current_total, distance, time, cox, cred, cchem]
         # current_total: vector of current at each discrete time
         # potential: vector of discrete potentials
         # time: vector of discrete times
         # distance: vector of discrete distances
         # cox: matrix of ox concentrations in diffusion grid
         # cred: matrix of red concentrations in diffusion grid
+        # cchem: matrix of chemical species concentrations in diffusion grid
+
+        result = SimulationResult(self.time, self.potential, self.current_total, self.distance, self.conc,
+                                  self.species, self.snapshot_time, dtype)
+        result.profiler = self.profiler
+        return result
+
+
+class SimulationStream():
+    """Results of a run chunk by chunk, while the solver advances.
+
+    Iterating runs the simulation and yields a SimulationResult for every
+    chunksize time steps, with the time, potential and current of those
+    steps and, if surface is True, the concentrations of every species at
+    the electrode (conc shaped (steps, species, 1), distance = 0). Only the
+    last two concentration rows are held, so a run can be plotted live,
+    stopped early by leaving the loop, or written out as it goes; the
+    chunks together equal the results of Simulation with the same options.
+    SimulationResult.concatenate joins them. Adaptive steps and steady
+    state skipping are not available.
+    """
+
+    def __init__(self, simconfig, chunksize=100, surface=False, solver="explicit", tunits=1000, xunits=100,
+                 grid="uniform", gamma=1.1, mechanism_params=None, waveform=None, cycles=1, ir_mode="post"):
+        if hasattr(simconfig, "validate"):
+            simconfig.validate(solver=solver, tunits=tunits, xunits=xunits, grid=grid, gamma=gamma, cycles=cycles,
+                               waveform=waveform)
+        if ir_mode not in ("post", "coupled"):
+            raise ValueError("Unknown ir_mode: %s" % ir_mode)
+        self.setup = SimulationSetup(simconfig, tunits, xunits, grid, gamma, mechanism_params, waveform, cycles)
+        self.stepper = make_stepper(solver, self.setup.mech, self.setup.deltat, self.setup.distance)
+        self.alambda = self.stepper.alambda
+        self.damped = damped_steps(self.stepper, self.setup.time, self.setup.breakpoints()[1])
+        self.chunksize = chunksize
+        self.surface = surface
+        self.ir_mode = ir_mode
+
+    def __iter__(self):
+        setup, mech, stepper = self.setup, self.setup.mech, self.stepper
+        tunits = setup.tunits
+        rows = np.empty((2, len(mech.species), len(setup.distance)))
+        rows[:] = mech.bulk[:, None]
+        ohmic = None
+        if self.ir_mode == "coupled":
+            ohmic = OhmicCoupling(mech, setup.temp, setup.area, setup.Cdl, setup.ru, setup.deltat,
+                                  setup.potential[0])
+        # the t = 0 point is dropped for chronoamperometry, as in Simulation
+        first = 1 if setup.technique == "Chronoamperometry" else 0
+
+        for start in range(first, tunits + 1, self.chunksize):
+            steps = range(start, min(start + self.chunksize, tunits + 1))
+            jox = np.zeros((len(steps), len(mech.n)))
+            capcurrent = np.zeros(len(steps)) if ohmic else setup.capcurrent[steps.start:steps.stop].copy()
+            surface = np.empty((len(steps), len(mech.species)))
+            for k, i in enumerate(steps):
+                if i > 0:
+                    boundary = ohmic.boundary(setup.potential[i]) if ohmic else None
+                    if i in self.damped:
+                        jox[k] = stepper.damped_step(rows[(i - 1) % 2], rows[i % 2], setup.kf[i], setup.kb[i],
+                                                     boundary, 1 if ohmic else 2)
+                    else:
+                        jox[k] = stepper.step(rows[(i - 1) % 2], rows[i % 2], setup.kf[i], setup.kb[i], boundary)
+                    if ohmic:
+                        capcurrent[k] = ohmic.charging
+                surface[k] = rows[i % 2][:, 0]
+
+            current = F * setup.area * jox @ mech.n + capcurrent
+            if steps.start == 0:
+                current[0] = 0
+            current = current + 1e-6*setup.shift
+            potential = setup.potential[steps.start:steps.stop]
+            if self.ir_mode == "post":
+                potential = potential + setup.ru * current
+            yield SimulationResult(setup.time[steps.start:steps.stop], potential, current, np.zeros(1),
+                                   surface[:, :, None] if self.surface else None,
+                                   mech.species if self.surface else ())
+
+
+class BatchSimulation():
+    """Many simconfigs sharing one technique and grid shape, run together.
 
-        simdata = [self.potential, self.current_total, self.distance, self.time, self.cox, self.cred, self.cchem]
-        return simdata
\ No newline at end of file
+    simconfigs is a list of simconfigs or a config.SimConfigBatch. The
+    mechanisms must have the same species and reactions (E, EC, ECat and CE
+    all do), but their rate constants may differ. Every array carries the
+    configs along a leading batch axis and only the last concentration rows
+    are kept, so the result is the stacked currents and potentials.
+    """
+
+    def __init__(self, simconfigs, solver="explicit", tunits=1000, xunits=100, grid="uniform", gamma=1.1,
+                 mechanism_params=None):
+        # a config.SimConfigBatch, or each config.SimConfig of a list, is
+        # checked before the run, including the stability of the explicit
+        # solver for every config
+        options = dict(solver=solver, tunits=tunits, xunits=xunits, grid=grid, gamma=gamma)
+        if hasattr(simconfigs, "validate"):
+            simconfigs.validate(**options)
+        else:
+            for simconfig in simconfigs:
+                if hasattr(simconfig, "validate"):
+                    simconfig.validate(**options)
+
+        # values: the numeric fields as arrays with one entry per config
+        if hasattr(simconfigs, "technique"):
+            technique = simconfigs.technique
+            mechanisms = [simconfigs.mechanism] * len(simconfigs)
+            values = {name: getattr(simconfigs, name) for name in SIMCONFIG_FIELDS[2:]}
+        else:
+            listed = [dict(zip(SIMCONFIG_FIELDS, simconfig)) for simconfig in simconfigs]
+            if len(set(v["technique"] for v in listed)) != 1:
+                raise ValueError("A batch must share one technique")
+            technique = listed[0]["technique"]
+            mechanisms = [v["mechanism"] for v in listed]
+            values = {name: np.array([v[name] for v in listed], dtype=float) for name in SIMCONFIG_FIELDS[2:]}
+        values["technique"] = technique
+
+        # mech: the mechanism structure is built per config and stacked; E
+        # has no chem species, so with EC, ECat or CE configs it gets an
+        # idle one
+        configs = [dict(technique=technique, mechanism=mechanism,
+                        **{name: values[name][b] for name in SIMCONFIG_FIELDS[2:]})
+                   for b, mechanism in enumerate(mechanisms)]
+        compiled = [build_mechanism(config, mechanism_params) for config in configs]
+        if len(set(c.species for c in compiled)) > 1:
+            compiled = [mechanism_e(config, chem=True).compile() if config["mechanism"] == "E" else c
+                        for config, c in zip(configs, compiled)]
+        mech = CompiledMechanism.stack(compiled)
+
+        # time, potentials, rate constants and grids of the whole batch from
+        # the field arrays; kf, kb: (time, batch, electron transfers)
+        self.time, self.potential, slope, jumps = default_programs(values, tunits)
+        self.capcurrent = values["area"][:, None] * values["Cdl"][:, None] * 1e-6 * slope
+        kf, kb = mech.rate_constants(self.potential.T, values["temp"][:, None])
+        deltat = self.time[:, -1] / tunits
+        xtot = 6 * np.sqrt(mech.D.max(axis=-1) * self.time[:, -1])
+        self.distance = spatial_grid(xtot, xunits, grid, gamma)
+
+        # rows: previous and current concentrations, (batch, species, distance)
+        rows = np.empty((2,) + mech.bulk.shape + (xunits + 1,))
+        rows[:] = mech.bulk[:, :, None]
+        jox = np.zeros((tunits + 1,) + mech.n.shape)
+
+        stepper = make_stepper(solver, mech, deltat, self.distance)
+        self.alambda = stepper.alambda
+        # the jumps of every config are damped for the whole batch
+        damped = set().union(*(damped_steps(stepper, time, jumps) for time, jumps in zip(self.time, jumps)))
+
+        for i in range(1, tunits + 1):
+            step = stepper.damped_step if i in damped else stepper.step
+            jox[i] = step(rows[(i - 1) % 2], rows[i % 2], kf[i], kb[i])
+        # conc: last concentration rows of every config
+        self.conc = rows[tunits % 2]
+
+        self.current_total = F * values["area"][:, None] * np.einsum("tbk,bk->bt", jox, mech.n) + self.capcurrent
+        self.current_total[:, 0] = 0
+        self.current_total = self.current_total + 1e-6*values["shift"][:, None]
+
+        # Calculate iR drop and correct potentials
+        self.potential = self.potential + values["ru"][:, None] * self.current_total
+
+        if technique == "Chronoamperometry":
+            self.potential = self.potential[:, 1:]
+            self.current_total = self.current_total[:, 1:]
+            self.time = self.time[:, 1:]
+
+    def get_data(self):
+        # stacked potentials, currents and times, one row per config
+        return [self.potential, self.current_total, self.time]
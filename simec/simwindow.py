@@ -29,13 +29,14 @@ matplotlib.use("Qt5Agg")
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
+import time
 import numpy as np
-from scipy.interpolate import interp1d
 import expdata
 
-
-TIMERLIST = []
-RUNBUTTON = []
+# PLAYBACK_TIME: seconds the dynamic plot takes to draw the whole curves;
+# FRAME_INTERVAL: milliseconds between frames (about 60 per second)
+PLAYBACK_TIME = 5.0
+FRAME_INTERVAL = 16
 
 
 class MyMplCanvas(FigureCanvas):
@@ -69,11 +70,9 @@ class MyDynamicMplCanvas(MyMplCanvas):
         self.expfile = expfile
         self.blank = blank
 
-        self.numelements = len(self.xdata)
         self.labelx = 'E / V'
         self.labely = 'i / $\mu$A'
         self.title = 'Voltammetry'
-        self.i = 0
 
         if self.expfile:
             getdata = expdata.GetData(expfile)
@@ -110,6 +109,8 @@ class MyDynamicMplCanvas(MyMplCanvas):
             x2 = np.linspace(endx[0], endx[len(endx)-1], num=lenendx)
 
             # Make interpolation function of forward and backward sweeps for the simulated current
+            # (scipy is only imported when an experimental file is compared)
+            from scipy.interpolate import interp1d
             fhalf = interp1d(halfx, halfy, 'cubic')
             fend = interp1d(endx, endy, 'cubic')
 
@@ -128,49 +129,71 @@ class MyDynamicMplCanvas(MyMplCanvas):
                 self.xdata = self.blankxdata
 
 
-        if self.static:
-            self.update_figure()
-        else:
-            self.timer = QTimer(self)
-            TIMERLIST.append(self.timer)
-            self.timer.timeout.connect(self.update_figure)
-            self.timer.start(1)
-
-    def update_figure(self):
-        faster = True
-        if faster:
-            self.i +=5
-        else:
-            self.i += 1
-        print(self.i, '/', self.numelements)
-        self.axes.cla()
-
-        if self.static:
-            self.axes.plot(self.xdata, self.ydata, 'b', label="cox")
-            if self.expfile:
-                self.axes.plot(self.expxdata, self.expydata, 'r', label="exp")
-        else:
-            self.axes.plot(self.xdata[0:self.i], self.ydata[0:self.i], 'b', label="cox")
-            if self.expfile:
-                self.axes.plot(self.expxdata[0:self.i], self.expydata[0:self.i], 'r', label="cox")
-
+        # The lines are made once and only their data changes afterwards.
+        # Static: the whole curves are drawn once. Dynamic: the axes are set
+        # to the full range of the data first, and each frame restores the
+        # cached background (axes, labels, grid) and blits the lines only.
         self.axes.set_title(self.title)
-
         self.axes.grid()
         self.axes.set_xlabel(self.labelx, fontsize=14)
         self.axes.set_ylabel(self.labely, fontsize=14)
-
+        self.lines = [self.axes.plot(self.xdata, self.ydata, 'b', label="cox", animated=not self.static)[0]]
+        if self.expfile:
+            self.lines.append(self.axes.plot(self.expxdata, self.expydata, 'r', label="exp",
+                                             animated=not self.static)[0])
         self.figure.tight_layout()
-        self.draw()
 
         if self.static:
-            RUNBUTTON[0].setEnabled(True)
+            self.draw()
         else:
-            if self.i >= self.numelements:
-                #FIXME: when dynamic plotting expfile + simulated - it stops before the end potential
-                for timer in TIMERLIST:
-                    timer.stop()
-                RUNBUTTON[0].setEnabled(True)
+            # background: the figure without the lines, cached on every full
+            # draw (e.g. after a resize)
+            self.background = None
+            self.mpl_connect('draw_event', self.on_draw)
+            self.show_fraction(0.0)
+            self.draw()
+            self.started = time.perf_counter()
+            self.timer = QTimer(self)
+            self.timer.timeout.connect(self.update_figure)
+            self.timer.start(FRAME_INTERVAL)
+
+    def show_fraction(self, fraction):
+        # the first fraction of every curve, so all of them end together
+        data = [(self.xdata, self.ydata)]
+        if self.expfile:
+            data.append((self.expxdata, self.expydata))
+        for line, (x, y) in zip(self.lines, data):
+            i = int(round(fraction * len(x)))
+            line.set_data(x[:i], y[:i])
+
+    def on_draw(self, event):
+        self.background = self.copy_from_bbox(self.figure.bbox)
+        for line in self.lines:
+            if line.get_animated():
+                self.axes.draw_artist(line)
+
+    def update_figure(self):
+        # frames are paced by the wall clock: the curves take PLAYBACK_TIME
+        # seconds to complete, however long each frame takes to draw
+        fraction = min(1.0, (time.perf_counter() - self.started) / PLAYBACK_TIME)
+        self.show_fraction(fraction)
+        if self.background is not None:
+            self.restore_region(self.background)
+            for line in self.lines:
+                self.axes.draw_artist(line)
+            self.blit(self.figure.bbox)
+
+        if fraction >= 1.0:
+            # the finished curves become part of the figure, as in the
+            # static plot
+            self.stop()
+            for line in self.lines:
+                line.set_animated(False)
+            self.draw_idle()
+
+    def stop(self):
+        if not self.static:
+            self.timer.stop()
 
 
 class SimWindow (QMainWindow):
@@ -179,11 +202,6 @@ class SimWindow (QMainWindow):
 
         potential, current, distance, time, cox, cred, cchem = simdata
 
-        # FIXME: Small hack to enable/disable the mainwindow RunButton with a global variable
-        # FIXME: when it fails, the button gets irreversibly disabled
-        RUNBUTTON.append(parent.runButton)
-        RUNBUTTON[0].setEnabled(False)
-
         self.ui = Ui_SimWindow()
         self.ui.setupUi(self)
         self.centralLayout = self.ui.centrallyout
@@ -205,6 +223,8 @@ class SimWindow (QMainWindow):
 
         dc = MyDynamicMplCanvas(width=4, height=4, dpi=100, xdata=xdata, ydata=ydata, static=static, expfile=expfile, blank=blank)
 
+        self.canvas = dc
+
         self.setGeometry(400,400,400,400)
         toolbar = NavigationToolbar(dc, self)
         self.centralLayout.addWidget(toolbar)
@@ -214,7 +234,5 @@ class SimWindow (QMainWindow):
         self.setFocus()
 
     def closeEvent(self, event):
-        for timer in TIMERLIST:
-            timer.stop()
-        RUNBUTTON[0].setEnabled(True)
+        self.canvas.stop()
         QMainWindow.closeEvent(self, event)
\ No newline at end of file
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Parameter sweeps over simulation configs.
+Expands a base simconfig over a grid of parameter values and runs the
+simulations in a pool of worker processes, yielding results as they finish.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from simulation import SIMCONFIG_FIELDS
+from convolution import simulate
+from cache import config_key
+from config import SimConfig
+
+
+def with_params(simconfig, params):
+    # copy of simconfig with the named fields replaced
+    if isinstance(simconfig, SimConfig):
+        return simconfig.replace(**params)
+    simconfig = list(simconfig)
+    for name, value in params.items():
+        simconfig[SIMCONFIG_FIELDS.index(name)] = value
+    return simconfig
+
+
+def parameter_grid(simconfig, **values):
+    # Cartesian product of the values given for each field, e.g.
+    # parameter_grid(base, ko=[0.01, 0.1], alpha=[0.4, 0.5]) -> 4 configs
+    for name in values:
+        if name not in SIMCONFIG_FIELDS:
+            raise ValueError("Unknown simconfig field: %s" % name)
+    names = list(values)
+    return [(dict(zip(names, combo)), with_params(simconfig, dict(zip(names, combo))))
+            for combo in itertools.product(*(values[name] for name in names))]
+
+
+def parameter_list(simconfig, **values):
+    # one config per position in equally long value lists, e.g.
+    # parameter_list(base, ko=[0.01, 0.1], alpha=[0.4, 0.5]) -> 2 configs
+    lengths = set(len(v) for v in values.values())
+    if len(lengths) > 1:
+        raise ValueError("Parameter lists must have the same length")
+    for name in values:
+        if name not in SIMCONFIG_FIELDS:
+            raise ValueError("Unknown simconfig field: %s" % name)
+    names = list(values)
+    return [(dict(zip(names, combo)), with_params(simconfig, dict(zip(names, combo))))
+            for combo in zip(*(values[name] for name in names))]
+
+
+def run_chunk(chunk, simkwargs):
+    # worker: run a chunk of (index, simconfig) pairs
+    return [(index, simulate(simconfig, **simkwargs).get_data()) for index, simconfig in chunk]
+
+
+def run_sweep(cases, workers=None, chunksize=1, cache=None, **simkwargs):
+    """Run (params, simconfig) cases in a process pool.
+
+    Cases are sent to the workers in chunks of chunksize, and
+    (index, params, simdata) tuples are yielded in the order they finish.
+    Extra keyword arguments go to convolution.simulate, which uses the
+    convolution engine for E mechanism cases; the concentration history is
+    not kept unless storage="full" is asked for, so results stay small.
+    With a cache (cache.SimulationCache), cached cases are yielded first and
+    only the others are simulated.
+    """
+    cases = list(cases)
+    simkwargs.setdefault("storage", "rolling")
+    indexed = []
+    keys = {}
+    for index, (params, simconfig) in enumerate(cases):
+        if cache is not None:
+            keys[index] = config_key(simconfig, **simkwargs)
+            simdata = cache.get(keys[index])
+            if simdata is not None:
+                yield index, params, simdata
+                continue
+        indexed.append((index, simconfig))
+    chunks = [indexed[i:i + chunksize] for i in range(0, len(indexed), chunksize)]
+
+    # leaving the loop early (or an error) cancels the chunks not started
+    # yet, so a consumer can stop the sweep; running ones still finish
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(run_chunk, chunk, simkwargs) for chunk in chunks]
+        for future in as_completed(futures):
+            for index, simdata in future.result():
+                if cache is not None:
+                    simdata = cache.put(keys[index], simdata)
+                yield index, cases[index][0], simdata
+    finally:
+        executor.shutdown(cancel_futures=True)
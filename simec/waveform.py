@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Potential-time programs.
+A waveform is a sequence of segments (ramps, steps, holds and pulse trains)
+evaluated as NumPy arrays at any times, in chunks, so long programs are
+never expanded into Python lists.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__author__ = "Daniel Martin-Yerga"
+__email__ = "dyerga@gmail.com"
+__license__ = "GPLv3"
+__program__ = "simEC"
+__version__ = "0.1"
+
+import numpy as np
+
+
+class Ramp():
+    # linear sweep from Efrom to Eto at scanrate (V/s)
+    def __init__(self, Efrom, Eto, scanrate):
+        self.Efrom = Efrom
+        self.Eto = Eto
+        self.duration = abs(Eto - Efrom) / scanrate
+        self.rate = np.sign(Eto - Efrom) * scanrate
+
+    def start(self):
+        return self.Efrom
+
+    def end(self):
+        return self.Eto
+
+    def values(self, t, side="right"):
+        return self.Efrom + self.rate * t
+
+    def slope(self, t):
+        return np.full(np.shape(t), self.rate)
+
+    def breaks(self):
+        return [], []
+
+
+class Step():
+    # jump to E and stay there for duration
+    def __init__(self, E, duration):
+        self.E = E
+        self.duration = duration
+
+    def start(self):
+        return self.E
+
+    def end(self):
+        return self.E
+
+    def values(self, t, side="right"):
+        return np.full(np.shape(t), float(self.E))
+
+    def slope(self, t):
+        return np.zeros(np.shape(t))
+
+    def breaks(self):
+        return [], []
+
+
+class Hold(Step):
+    # stay at the potential where the previous segment ended
+    def __init__(self, duration):
+        Step.__init__(self, None, duration)
+
+
+class PulseTrain():
+    # count periods of tbase at Ebase followed by tpulse at Epulse; both
+    # potentials move by increment after each period (staircase and
+    # differential pulse programs)
+    def __init__(self, Ebase, Epulse, tbase, tpulse, count, increment=0.0):
+        self.Ebase = Ebase
+        self.Epulse = Epulse
+        self.tbase = tbase
+        self.period = tbase + tpulse
+        self.count = count
+        self.increment = increment
+        self.duration = count * self.period
+
+    def start(self):
+        return self.Ebase if self.tbase > 0 else self.Epulse
+
+    def end(self):
+        return self.Epulse + (self.count - 1) * self.increment
+
+    def values(self, t, side="right"):
+        # side: value taken at the discontinuities, "right" for the new
+        # potential and "left" for the one before the jump
+        t = np.asarray(t, dtype=float)
+        if side == "right":
+            k = np.floor(t / self.period)
+        else:
+            k = np.ceil(t / self.period) - 1
+        k = np.clip(k, 0, self.count - 1)
+        local = t - k * self.period
+        pulse = local >= self.tbase if side == "right" else local > self.tbase
+        return np.where(pulse, self.Epulse, self.Ebase) + k * self.increment
+
+    def slope(self, t):
+        return np.zeros(np.shape(t))
+
+    def breaks(self):
+        # jumps at the start of every pulse and every new period
+        starts = np.arange(self.count) * self.period
+        jumps = np.concatenate([starts[1:], starts + self.tbase])
+        return [], sorted(jumps[(jumps > 0) & (jumps < self.duration)])
+
+
+class Waveform():
+    """Segments played one after another from t = 0.
+
+    Segments cover [start, end) of their time span, so at a jump the
+    potential takes the value of the new segment unless side="left" is asked
+    for; after the last segment the final potential is held.
+    """
+
+    def __init__(self, segments):
+        self.segments = []
+        for segment in segments:
+            if isinstance(segment, Hold):
+                segment = Step(self.segments[-1].end() if self.segments else 0.0, segment.duration)
+            if segment.duration > 0:
+                self.segments.append(segment)
+        if not self.segments:
+            raise ValueError("A waveform needs at least one segment with a duration")
+        self.ends = np.cumsum([segment.duration for segment in self.segments])
+        self.starts = np.concatenate([[0.0], self.ends[:-1]])
+        self.duration = self.ends[-1]
+
+    @classmethod
+    def cv(cls, Estart, Eswitch, scanrate, cycles=1):
+        # cyclic voltammetry: Estart -> Eswitch -> Estart, cycles times
+        return cls([Ramp(Estart, Eswitch, scanrate), Ramp(Eswitch, Estart, scanrate)] * cycles)
+
+    @classmethod
+    def steps(cls, potentials, durations):
+        # multi-pulse chronoamperometry: hold each potential for its duration
+        return cls([Step(E, duration) for E, duration in zip(potentials, durations)])
+
+    def __add__(self, other):
+        return Waveform(self.segments + other.segments)
+
+    def locate(self, t, side="right"):
+        # index of the segment playing at each time t
+        return np.minimum(np.searchsorted(self.ends, t, side=side), len(self.segments) - 1)
+
+    def potential(self, t, side="right"):
+        t = np.asarray(t, dtype=float)
+        index = self.locate(t, side)
+        E = np.empty(t.shape)
+        for k in np.unique(index):
+            segment = self.segments[k]
+            mask = index == k
+            E[mask] = segment.values(np.minimum(t[mask] - self.starts[k], segment.duration), side)
+        return E if E.ndim else float(E)
+
+    def slope(self, t):
+        # dE/dt at times t, taken on the segment that starts at t; zero after
+        # the end of the program
+        t = np.asarray(t, dtype=float)
+        index = self.locate(t)
+        rate = np.zeros(t.shape)
+        for k in np.unique(index):
+            mask = (index == k) & (t < self.duration)
+            rate[mask] = self.segments[k].slope(t[mask] - self.starts[k])
+        return rate
+
+    def chunks(self, time, chunksize=65536):
+        # potentials at the times in time, one chunk at a time
+        for first in range(0, len(time), chunksize):
+            yield self.potential(time[first:first + chunksize])
+
+    def sample(self, time, chunksize=65536):
+        E = np.empty(len(time))
+        for first, values in zip(range(0, len(time), chunksize), self.chunks(time, chunksize)):
+            E[first:first + len(values)] = values
+        return E
+
+    def breakpoints(self):
+        # stops: times where the slope changes; jumps: times where the
+        # potential is discontinuous
+        stops, jumps = [], []
+        for k, segment in enumerate(self.segments):
+            inner_stops, inner_jumps = segment.breaks()
+            stops.extend(float(self.starts[k] + s) for s in inner_stops)
+            jumps.extend(float(self.starts[k] + s) for s in inner_jumps)
+            if k > 0:
+                if segment.start() != self.segments[k - 1].end():
+                    jumps.append(float(self.starts[k]))
+                else:
+                    stops.append(float(self.starts[k]))
+        return stops, jumps